@@ -1,15 +1,35 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import contextlib
+import contextvars
 import enum
+import fnmatch
+import functools
+import hashlib
+import importlib
+import io
 import json
+import math
+import os
+import queue
+import sys
+import threading
+import time
 import warnings
 from dataclasses import asdict, is_dataclass
-from typing import Any, List
+from pathlib import Path
+from typing import Any, Callable, Collection, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
+from uuid import uuid4
 
-from allure_pytest.utils import allure_title
+from allure_commons.model2 import ATTACHMENT_PATTERN, Attachment, ExecutableItem, Status, TestAfterResult
+from allure_commons.model2 import TestBeforeResult, TestResult, TestStepResult
+from allure_commons.utils import now
+from allure_pytest.utils import allure_title, get_status_details
 
 import _pytest.config
 import _pytest.python
 import allure
+import allure_commons
 import py
 import pytest
 from _pytest.main import wrap_session
@@ -21,13 +41,32 @@ class Options(str, enum.Enum):
     # decoration
     STAGING = "--staging"
     ASSERT_STEPS = "--assert-steps"
+    ASSERT_STEPS_ASYNC = "--assert-steps-async"
+    ASSERT_STEPS_MAX_PER_TEST = "--assert-steps-max-per-test"
+    ASSERT_STEPS_MAX_BYTES_PER_TEST = "--assert-steps-max-bytes-per-test"
+    ASSERT_STEPS_MAX_BYTES_PER_SESSION = "--assert-steps-max-bytes-per-session"
+    ASSERT_STEPS_SAMPLE_EVERY = "--assert-steps-sample-every"
+    STAGING_REORDER = "--staging-reorder"
+    STAGING_MANIFEST = "--staging-manifest"
+    STAGING_DURATIONS = "--staging-durations"
+    STAGING_DURATIONS_JSON = "--staging-durations-json"
     # linter
     BDD_FORMAT = "--bdd-format"
     FEATURE_TITLE = "--feature-title"
+    GHERKIN_FEATURES = "--gherkin-features"
+    LINT_LF = "--lint-lf"
+    LINT_LF_ALL = "--lint-lf-all"
     # warnings enabling
     WARNINGS = "--staging-warnings"
     # skipped
     FAIL_ON_ALL_SKIPPED = "--all-skipped-fail"
+    # sharding
+    SHARD_INDEX = "--shard-index"
+    SHARD_COUNT = "--shard-count"
+    STORE_DURATIONS = "--store-durations"
+    # linter baseline
+    MARKERS_BASELINE = "--markers-baseline"
+    MARKERS_BASELINE_UPDATE = "--markers-baseline-update"
 
     def __str__(self):
         return str(self.value)
@@ -57,17 +96,103 @@ BDD_MARKED_OK_HEADLINE = "Cool, every test class with its functions is marked wi
 FEATURE_TITLE_MARKED_OK_HEADLINE = "Cool, every test class with its functions is marked with feature-title tags."
 
 STAGING_HELP = f"Stage project with markers based on directories names in '{CORRECT_TESTS_FOLDER_PATTERN}' folder"
+STAGING_REORDER_HELP = "Group tests by staging markers and higher scope fixtures to reduce fixtures setups"
+STAGING_MANIFEST_HELP = "Store staging markers of tests into file and reuse them while tests directories are unchanged"
+STAGING_DURATIONS_HELP = "Show setup, call and teardown durations percentiles for every staging marker"
+STAGING_DURATIONS_JSON_HELP = f"Export '{Options.STAGING_DURATIONS}' statistics into JSON file"
+STAGING_DURATIONS_PLUGIN_NAME = "markers_presence_staging_durations"
+STAGING_DURATIONS_HEADLINE = "Durations by staging markers:"
+STAGING_DURATIONS_NO_STAGE = "(no stage)"
+STAGING_STAGE_PROPERTY = "markers_presence_stage"
+STAGING_DURATIONS_PHASES = ("setup", "call", "teardown")
+STAGING_DURATIONS_PERCENTILES = (50, 95, 99)
+HISTOGRAM_MIN_VALUE = 1e-6
+HISTOGRAM_GROWTH_FACTOR = 1.05
+STAGING_TEST_BUDGETS_HELP = "Max duration of every test in seconds by staging markers, e.g. 'unit = 0.1'"
+STAGING_TOTAL_BUDGETS_HELP = "Max total duration of tests in seconds by staging markers, e.g. 'unit = 60'"
+STAGING_TEST_BUDGETS_PHASES_HELP = "Phases of tests included into 'staging_test_budgets', e.g. 'setup call teardown'"
+STAGING_BUDGETS_MODE_HELP = (
+    "Set 'fail' to fail session on exceeded total budgets (default), 'strict' to fail on exceeded per test budgets too "
+    "or 'warn' to only report exceeded staging budgets"
+)
+STAGING_BUDGETS_PLUGIN_NAME = "markers_presence_staging_budgets"
+STAGING_BUDGETS_MODES = ("fail", "strict", "warn")
+STAGING_BUDGETS_HEADLINE = "Staging budgets were exceeded:"
+STAGING_TOTAL_BUDGET_LINE = "Stage '{stage}': total {duration:.2f}s, budget {budget:.2f}s"
+STAGING_TEST_BUDGET_LINE = "Test '{nodeid}' (stage '{stage}'): {duration:.3f}s, budget {budget:.3f}s"
+STAGING_REORDER_PLUGIN_NAME = "markers_presence_staging_reorder"
+STAGING_REORDER_REPORT = "Staging reorder: estimated non-function fixtures setups {before} -> {after}, saved {saved}"
+HIGHER_FIXTURE_SCOPES = ("session", "package")
+NON_FUNCTION_FIXTURE_SCOPES = ("session", "package", "module", "class")
 ASSERT_STEPS_HELP = "Represent assertion comparisons with Allure steps"
+ASSERT_STEPS_ASYNC_HELP = "Serialize and write '--assert-steps' attachments in background thread"
+ASSERT_STEPS_MAX_PER_TEST_HELP = "Max number of '--assert-steps' Allure steps per test"
+ASSERT_STEPS_MAX_BYTES_PER_TEST_HELP = "Max size of '--assert-steps' attachments per test in bytes"
+ASSERT_STEPS_MAX_BYTES_PER_SESSION_HELP = "Max size of '--assert-steps' attachments per session in bytes"
+ASSERT_STEPS_SAMPLE_EVERY_HELP = "Keep every N-th '--assert-steps' Allure step after per test steps limit is reached"
+ASSERT_STEPS_SAMPLE_EVERY_USAGE_ERROR = (
+    f"Option '{Options.ASSERT_STEPS_SAMPLE_EVERY}' should be used with '{Options.ASSERT_STEPS_MAX_PER_TEST}'!"
+)
+ASSERT_STEPS_BUDGET_HEADLINE = "Assertion steps budget was exhausted, dropped {dropped} step(s) in {tests} test(s):"
 BDD_FORMAT_HELP = "Show not classified functions usage and items without Allure BDD tags"
 FEATURE_TITLE_HELP = "Show not classified functions usage and items without '@allure.feature' and '@allure.title' tags"
 STAGING_WARNINGS_HELP = "Enable warnings for staging"
+GHERKIN_FEATURES_HELP = "Check titles and tags of Gherkin '.feature' files without BDD frameworks collection"
+GHERKIN_FEATURE_TAGS_HELP = "Tags (without '@') required for every Gherkin feature with '--gherkin-features' option"
+GHERKIN_FEATURES_USAGE_ERROR = (
+    f"Option '{Options.GHERKIN_FEATURES}' should be used with '{Options.BDD_FORMAT}' or '{Options.FEATURE_TITLE}'!"
+)
+GHERKIN_SCENARIO_TAGS_HELP = "Tags (without '@') required for every Gherkin scenario with '--gherkin-features' option"
+
+LINT_LF_HELP = "Lint only files with issues from the last lint run and files changed since it"
+LINT_LF_ALL_HELP = f"Lint all files with '{Options.LINT_LF}' option when there are no failed or changed files"
+LINT_LF_HEADLINE = "Re-checking {count} previously failed or changed file(s)."
+LINT_LF_NOTHING_HEADLINE = "No previously failed or changed files, linting was skipped."
+LINT_LF_CACHE_KEY = "markers_presence/lint_failed"
+CONFTEST_FILE_NAME = "conftest.py"
+
+NO_TITLE_GHERKIN_HEADLINE = "You should set title for your Gherkin feature(s) and scenario(s):"
+NO_TAGS_GHERKIN_HEADLINE = "You should set tags for your Gherkin feature(s) and scenario(s):"
+UNDECODABLE_GHERKIN_HEADLINE = "You should save your Gherkin file(s) in UTF-8 encoding:"
+
+GHERKIN_FILE_PATTERN = "*.feature"
+GHERKIN_FILE_KEYWORD = "File"
+GHERKIN_FEATURE_KEYWORD = "Feature"
+GHERKIN_SCENARIO_KEYWORD = "Scenario"
+GHERKIN_FEATURE_PREFIXES = ("Feature:",)
+GHERKIN_RULE_PREFIXES = ("Rule:",)
+GHERKIN_SCENARIO_PREFIXES = ("Scenario Outline:", "Scenario Template:", "Scenario:", "Example:")
+GHERKIN_DOCSTRING_DELIMITERS = ('"""', "```")
+GHERKIN_EXCLUDED_TAG = "PRESENCE_IGNORE"
 
 ASSERTION_FAILED_MESSAGE = "Assertion failed"
 ALLURE_MAX_STRING_LENGTH = 25
+ALLURE_LISTENER_PLUGIN_NAME = "allure_listener"
+
+ATTACHMENTS_WRITER_PLUGIN_NAME = "markers_presence_attachments_writer"
+ATTACHMENTS_QUEUE_MAX_SIZE = 128
+ATTACHMENTS_WRITER_THREAD_NAME = "markers-presence-attachments-writer"
+ASSERT_STEPS_BUDGET_PLUGIN_NAME = "markers_presence_assert_steps_budget"
 
 FAIL_ON_ALL_SKIPPED_HELP = "Enable setting of fail exitcode when all session tests were skipped"
 FAIL_ON_ALL_SKIPPED_HEADLINE = "Changed exitcode to FAILED because all tests were skipped."
 
+SHARD_INDEX_HELP = "Index of shard to run, from 0 to '--shard-count' - 1"
+SHARD_COUNT_HELP = "Split tests into N shards balanced by stages and durations from previous runs"
+STORE_DURATIONS_HELP = f"Store tests durations into pytest cache for '{Options.SHARD_COUNT}' option"
+SHARDING_USAGE_ERROR = f"Options '{Options.SHARD_INDEX}' and '{Options.SHARD_COUNT}' should be used together!"
+SHARDING_DURATIONS_CACHE_KEY = "markers_presence/durations"
+SHARDING_DURATIONS_RECORDER_PLUGIN_NAME = "markers_presence_durations_recorder"
+SHARDING_DEFAULT_DURATION = 1.0
+
+MARKERS_BASELINE_HELP = "Report only linter issues which are not recorded in baseline file (created if missing)"
+MARKERS_BASELINE_UPDATE_HELP = "Rewrite linter baseline file with current issues"
+MARKERS_BASELINE_HEADLINE = "Linter baseline '{path}': {suppressed} known issue(s) suppressed, {fixed} fixed."
+MARKERS_BASELINE_WRITTEN_HEADLINE = "Linter baseline '{path}' was written with {count} issue(s)."
+MARKERS_BASELINE_HASH_LENGTH = 16
+MARKERS_BASELINE_USAGE_ERROR = "Linter baseline '{path}' has malformed line {line}, expected '<hash> <file path>'!"
+DESELECTED_NODEIDS_KEY = pytest.StashKey[Set[str]]()
+
 CURDIR = py.path.local()
 _DIR_SUPPORTED_PATTERNS = ["[!__]*", "[!.]*"]
 
@@ -81,6 +206,36 @@ def pytest_addoption(parser):
         default=False,
         help=STAGING_HELP,
     )
+    group.addoption(
+        Options.STAGING_REORDER,
+        action="store_true",
+        dest="staging_reorder",
+        default=False,
+        help=STAGING_REORDER_HELP,
+    )
+    group.addoption(
+        Options.STAGING_MANIFEST,
+        action="store",
+        dest="staging_manifest",
+        metavar="PATH",
+        default=None,
+        help=STAGING_MANIFEST_HELP,
+    )
+    group.addoption(
+        Options.STAGING_DURATIONS,
+        action="store_true",
+        dest="staging_durations",
+        default=False,
+        help=STAGING_DURATIONS_HELP,
+    )
+    group.addoption(
+        Options.STAGING_DURATIONS_JSON,
+        action="store",
+        dest="staging_durations_json",
+        metavar="PATH",
+        default=None,
+        help=STAGING_DURATIONS_JSON_HELP,
+    )
     group.addoption(
         Options.ASSERT_STEPS,
         action="store_true",
@@ -88,6 +243,49 @@ def pytest_addoption(parser):
         default=False,
         help=ASSERT_STEPS_HELP,
     )
+    group.addoption(
+        Options.ASSERT_STEPS_ASYNC,
+        action="store_true",
+        dest="assert_steps_async",
+        default=False,
+        help=ASSERT_STEPS_ASYNC_HELP,
+    )
+    group.addoption(
+        Options.ASSERT_STEPS_MAX_PER_TEST,
+        action="store",
+        type=int,
+        metavar="N",
+        dest="assert_steps_max_per_test",
+        default=None,
+        help=ASSERT_STEPS_MAX_PER_TEST_HELP,
+    )
+    group.addoption(
+        Options.ASSERT_STEPS_MAX_BYTES_PER_TEST,
+        action="store",
+        type=int,
+        metavar="N",
+        dest="assert_steps_max_bytes_per_test",
+        default=None,
+        help=ASSERT_STEPS_MAX_BYTES_PER_TEST_HELP,
+    )
+    group.addoption(
+        Options.ASSERT_STEPS_MAX_BYTES_PER_SESSION,
+        action="store",
+        type=int,
+        metavar="N",
+        dest="assert_steps_max_bytes_per_session",
+        default=None,
+        help=ASSERT_STEPS_MAX_BYTES_PER_SESSION_HELP,
+    )
+    group.addoption(
+        Options.ASSERT_STEPS_SAMPLE_EVERY,
+        action="store",
+        type=int,
+        metavar="N",
+        dest="assert_steps_sample_every",
+        default=None,
+        help=ASSERT_STEPS_SAMPLE_EVERY_HELP,
+    )
     group.addoption(
         Options.BDD_FORMAT,
         action="store_true",
@@ -102,6 +300,27 @@ def pytest_addoption(parser):
         default=False,
         help=FEATURE_TITLE_HELP,
     )
+    group.addoption(
+        Options.GHERKIN_FEATURES,
+        action="store_true",
+        dest="gherkin_features",
+        default=False,
+        help=GHERKIN_FEATURES_HELP,
+    )
+    group.addoption(
+        Options.LINT_LF,
+        action="store_true",
+        dest="lint_lf",
+        default=False,
+        help=LINT_LF_HELP,
+    )
+    group.addoption(
+        Options.LINT_LF_ALL,
+        action="store_true",
+        dest="lint_lf_all",
+        default=False,
+        help=LINT_LF_ALL_HELP,
+    )
     group.addoption(
         Options.WARNINGS,
         action="store_true",
@@ -116,6 +335,76 @@ def pytest_addoption(parser):
         default=False,
         help=FAIL_ON_ALL_SKIPPED_HELP,
     )
+    group.addoption(
+        Options.SHARD_INDEX,
+        action="store",
+        type=int,
+        metavar="N",
+        dest="shard_index",
+        default=None,
+        help=SHARD_INDEX_HELP,
+    )
+    group.addoption(
+        Options.SHARD_COUNT,
+        action="store",
+        type=int,
+        metavar="N",
+        dest="shard_count",
+        default=None,
+        help=SHARD_COUNT_HELP,
+    )
+    group.addoption(
+        Options.STORE_DURATIONS,
+        action="store_true",
+        dest="store_durations",
+        default=False,
+        help=STORE_DURATIONS_HELP,
+    )
+    group.addoption(
+        Options.MARKERS_BASELINE,
+        action="store",
+        dest="markers_baseline",
+        metavar="PATH",
+        default=None,
+        help=MARKERS_BASELINE_HELP,
+    )
+    group.addoption(
+        Options.MARKERS_BASELINE_UPDATE,
+        action="store_true",
+        dest="markers_baseline_update",
+        default=False,
+        help=MARKERS_BASELINE_UPDATE_HELP,
+    )
+
+    parser.addini("staging_test_budgets", type="linelist", default=[], help=STAGING_TEST_BUDGETS_HELP)
+    parser.addini("staging_total_budgets", type="linelist", default=[], help=STAGING_TOTAL_BUDGETS_HELP)
+    parser.addini("staging_test_budgets_phases", type="args", default=["call"], help=STAGING_TEST_BUDGETS_PHASES_HELP)
+    parser.addini("staging_budgets_mode", default=STAGING_BUDGETS_MODES[0], help=STAGING_BUDGETS_MODE_HELP)
+    parser.addini("gherkin_feature_tags", type="linelist", default=[], help=GHERKIN_FEATURE_TAGS_HELP)
+    parser.addini("gherkin_scenario_tags", type="linelist", default=[], help=GHERKIN_SCENARIO_TAGS_HELP)
+
+
+def pytest_configure(config):
+    is_sharding_enabled(config)
+    if config.option.gherkin_features and not (config.option.bdd_markers or config.option.feature_title):
+        raise pytest.UsageError(GHERKIN_FEATURES_USAGE_ERROR)
+    if config.option.assert_steps:
+        tracker = AllureStepsTracker(config)
+        allure_commons.plugin_manager.register(tracker)
+        config.add_cleanup(lambda: allure_commons.plugin_manager.unregister(tracker))
+    if config.option.assert_steps and config.option.assert_steps_async:
+        config.pluginmanager.register(AttachmentsWriter(config), ATTACHMENTS_WRITER_PLUGIN_NAME)
+    validate_assert_steps_budget(config)
+    if is_assert_steps_budget_set(config) and config.option.assert_steps:
+        config.pluginmanager.register(AssertStepsBudget(config), ASSERT_STEPS_BUDGET_PLUGIN_NAME)
+    if config.option.staging_reorder:
+        config.pluginmanager.register(StagingReorder(), STAGING_REORDER_PLUGIN_NAME)
+    if config.option.staging_durations or config.option.staging_durations_json:
+        config.pluginmanager.register(StagingDurations(config), STAGING_DURATIONS_PLUGIN_NAME)
+    if config.option.stage_markers and is_staging_budgets_set(config):
+        config.pluginmanager.register(StagingBudgets(config), STAGING_BUDGETS_PLUGIN_NAME)
+    if config.option.store_durations and not is_xdist_worker(config):
+        config.pluginmanager.register(DurationsRecorder(config), SHARDING_DURATIONS_RECORDER_PLUGIN_NAME)
 
 
 def pytest_cmdline_main(config):
@@ -126,9 +415,37 @@ def pytest_cmdline_main(config):
         return ExitCodes.SUCCESS
 
 
-def pytest_collection_modifyitems(session, config):
+def pytest_collection_modifyitems(session, config, items):
+    stages = {}
     if config.option.stage_markers:
-        mark_tests_by_location(session, config)
+        stages = mark_tests_by_location(session, config)
+    reorder = config.pluginmanager.get_plugin(STAGING_REORDER_PLUGIN_NAME)
+    if reorder is not None:
+        reorder.reorder(items, stages)
+    for name in (STAGING_DURATIONS_PLUGIN_NAME, STAGING_BUDGETS_PLUGIN_NAME):
+        plugin = config.pluginmanager.get_plugin(name)
+        if plugin is not None:
+            plugin.stages = stages
+    if is_sharding_enabled(config):
+        select_shard(config, items, stages)
+
+
+def pytest_deselected(items):
+    """
+    Remembers deselected tests and their classes, so linter baseline keeps their issues.
+    """
+    if not items:
+        return
+    deselected = items[0].config.stash.setdefault(DESELECTED_NODEIDS_KEY, set())
+    for item in items:
+        deselected.add(item.nodeid)
+        cls = item.getparent(_pytest.python.Class)
+        if cls is not None:
+            deselected.add(cls.nodeid)
+
+
+def get_deselected_nodeids(session) -> Set[str]:
+    return session.config.stash.get(DESELECTED_NODEIDS_KEY, set())
 
 
 @pytest.hookimpl
@@ -142,16 +459,62 @@ def pytest_terminal_summary(terminalreporter, exitstatus, config) -> None:
             tw.line(FAIL_ON_ALL_SKIPPED_HEADLINE, red=True)
 
 
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_protocol(item, nextitem):
+    if not item.config.option.assert_steps:
+        yield
+        return
+    token = _ASSERT_STEPS_CONTEXT.set(AssertStepsContext.for_item(item))
+    parents_token = _ASSERT_STEPS_PARENTS.set(())
+    yield
+    _ASSERT_STEPS_PARENTS.reset(parents_token)
+    _ASSERT_STEPS_CONTEXT.reset(token)
+
+
 @pytest.hookimpl
 def pytest_assertrepr_compare(config, op, left, right):
     if config.option.assert_steps:
-        comparison = AllureComparison(op=op, left=left, right=right)
-        comparison.compile_allure_step()
+        context = get_assert_steps_context()
+        budget = config.pluginmanager.get_plugin(ASSERT_STEPS_BUDGET_PLUGIN_NAME)
+        on_attached = None
+        if budget is not None:
+            on_attached = budget.acquire(context.usage if context is not None else None)
+        comparison = None
+        if budget is None or on_attached is not None:
+            comparison = AllureComparison(op=op, left=left, right=right)
+            comparison.compile_allure_step(
+                writer=config.pluginmanager.get_plugin(ATTACHMENTS_WRITER_PLUGIN_NAME),
+                on_attached=on_attached,
+                context=context,
+            )
 
         if is_repr_assert_for_objects(left, right):
+            if comparison is None:
+                comparison = AllureComparison(op=op, left=left, right=right)
             return comparison.get_pytest_assertrepr()
 
 
+def get_assert_steps_budget_options(config) -> Dict[Options, Optional[int]]:
+    return {
+        Options.ASSERT_STEPS_MAX_PER_TEST: config.option.assert_steps_max_per_test,
+        Options.ASSERT_STEPS_MAX_BYTES_PER_TEST: config.option.assert_steps_max_bytes_per_test,
+        Options.ASSERT_STEPS_MAX_BYTES_PER_SESSION: config.option.assert_steps_max_bytes_per_session,
+        Options.ASSERT_STEPS_SAMPLE_EVERY: config.option.assert_steps_sample_every,
+    }
+
+
+def validate_assert_steps_budget(config) -> None:
+    for option, value in get_assert_steps_budget_options(config).items():
+        if value is not None and value < 1:
+            raise pytest.UsageError(f"Option '{option}' should be positive!")
+    if config.option.assert_steps_sample_every is not None and config.option.assert_steps_max_per_test is None:
+        raise pytest.UsageError(ASSERT_STEPS_SAMPLE_EVERY_USAGE_ERROR)
+
+
+def is_assert_steps_budget_set(config) -> bool:
+    return any(value is not None for value in get_assert_steps_budget_options(config).values())
+
+
 def is_repr_assert_for_objects(*args):
     for obj in args:
         if isinstance(obj, (int, float, str, list, dict)):
@@ -171,11 +534,40 @@ def write_functions(tw, functions):
         tw.line(tplt.format(get_function_name(function), CURDIR.bestrelpath(function.fspath)))
 
 
+def write_gherkin_elements(tw, elements, options: Optional["LintOptions"] = None):
+    for element in elements:
+        line = f"{element.keyword}: '{element.name}', location: {CURDIR.bestrelpath(element.fspath)}:{element.line}"
+        if options is not None:
+            line += f", missing tags: {', '.join('@' + tag for tag in get_missing_gherkin_tags(element, options))}"
+        tw.line(line)
+
+
 def is_checking_failed(config, session):
-    session.perform_collect()
+    started = time.time()
     tw = _pytest.config.create_terminal_writer(config)
+    if config.option.lint_lf:
+        lf_paths = get_lint_lf_paths(config, session)
+        if lf_paths:
+            config.args = lf_paths
+        elif lf_paths is not None and not config.option.lint_lf_all:
+            tw.line()
+            tw.line(LINT_LF_NOTHING_HEADLINE, green=True)
+            return False
+    session.perform_collect([arg for arg in config.args if not fnmatch.fnmatch(arg, GHERKIN_FILE_PATTERN)])
     tw.line()
+    if config.option.lint_lf and lf_paths:
+        lf_paths = filter_lint_lf_paths(session, lf_paths)
+        tw.line(LINT_LF_HEADLINE.format(count=len(lf_paths)), yellow=True)
     issues = get_not_marked_items(config, session)
+    if config.option.markers_baseline:
+        baseline = LintBaseline(config.option.markers_baseline)
+        issues = baseline.apply(
+            issues,
+            update=config.option.markers_baseline_update,
+            scope=get_session_paths(session),
+            deselected=get_deselected_nodeids(session),
+        )
+        baseline.write_summary(tw)
     if not issues.are_exists():
         tw.line(CLASSES_OK_HEADLINE, green=True)
         if config.option.bdd_markers:
@@ -201,10 +593,126 @@ def is_checking_failed(config, session):
     if config.option.feature_title and issues.no_title_functions:
         tw.line(NO_TITLE_FUNCTIONS_HEADLINE, red=True)
         write_functions(tw, issues.no_title_functions)
+        tw.line()
 
+    if issues.no_title_gherkin_elements:
+        tw.line(NO_TITLE_GHERKIN_HEADLINE, red=True)
+        write_gherkin_elements(tw, issues.no_title_gherkin_elements)
+        tw.line()
+
+    if issues.no_tags_gherkin_elements:
+        tw.line(NO_TAGS_GHERKIN_HEADLINE, red=True)
+        write_gherkin_elements(tw, issues.no_tags_gherkin_elements, get_lint_options(config))
+        tw.line()
+
+    if issues.undecodable_gherkin_files:
+        tw.line(UNDECODABLE_GHERKIN_HEADLINE, red=True)
+        write_gherkin_elements(tw, issues.undecodable_gherkin_files)
+
+    store_lint_failures(config, session, issues, started)
     return issues.are_exists()
 
 
+def get_rootdir_relpath(config, path) -> str:
+    return os.path.relpath(str(path), str(config.rootpath))
+
+
+def get_nodeid_path(config, nodeid: str) -> str:
+    return os.path.join(str(config.rootpath), nodeid.split("::", 1)[0])
+
+
+def get_lint_lf_paths(config, session) -> Optional[List[str]]:
+    """
+    Returns files with issues from the last lint run and files changed since it,
+    or None when there was no lint run yet.
+    """
+    cache = getattr(config, "cache", None)
+    last_run = cache.get(LINT_LF_CACHE_KEY, None) if cache is not None else None
+    if last_run is None:
+        return None
+    paths = {get_nodeid_path(config, nodeid) for nodeid in last_run.get("nodeids", [])}
+    paths = {path for path in paths if os.path.exists(path)}
+    patterns = config.getini("python_files")
+    if config.option.gherkin_features:
+        patterns = [*patterns, GHERKIN_FILE_PATTERN]
+    for arg in config.args:
+        root = py.path.local(arg.split("::", 1)[0])
+        if root.check(file=True):
+            files = [root]
+        else:
+            files = root.visit(
+                fil=lambda x: x.check(file=True),
+                rec=lambda x: _is_suitable_dir(x) and not is_ignored_path(session, x),
+            )
+        for path in files:
+            if not any(path.fnmatch(pattern) for pattern in patterns) or path.mtime() < last_run["timestamp"]:
+                continue
+            if not is_ignored_path(session, path):
+                paths.add(path.strpath)
+    return sorted(paths)
+
+
+def is_ignored_path(session, path) -> bool:
+    """
+    Applies pytest collection ignore rules: 'norecursedirs' patterns (checked by the hook only in pytest >= 8),
+    'collect_ignore' and 'collect_ignore_glob' of conftests, '--ignore' options and virtualenvs.
+    Hook is called with conftests of the path directory (as pytest does during collection),
+    so nested conftests are applied too.
+    """
+    config = session.config
+    if path.check(dir=True) and any(path.fnmatch(pattern) for pattern in config.getini("norecursedirs")):
+        return True
+    ihook = session.gethookproxy(Path(path.dirpath().strpath))
+    return bool(ihook.pytest_ignore_collect(collection_path=Path(path.strpath), config=config))
+
+
+def is_collection_ignored(session, path) -> bool:
+    """
+    Checks the path and its parent directories up to rootdir.
+    """
+    rootdir = py.path.local(session.config.rootpath)
+    return any(is_ignored_path(session, part) for part in path.parts(reverse=True) if part.relto(rootdir))
+
+
+def filter_lint_lf_paths(session, lf_paths: List[str]) -> List[str]:
+    """
+    Explicitly passed paths are collected by pytest even if they are ignored, and nested conftests are loaded
+    only by collection, so ignored paths are dropped with collected items after collection.
+    """
+    lf_paths = [path for path in lf_paths if not is_collection_ignored(session, py.path.local(path))]
+    session.config.args = lf_paths
+    session.items[:] = [item for item in session.items if str(item.path) in lf_paths]
+    return lf_paths
+
+
+def get_rootdir_nodeid(config, item) -> str:
+    """
+    Node ids of Gherkin elements are relative to current directory, node ids of tests are relative to rootdir.
+    """
+    if isinstance(item, GherkinElement):
+        return f"{get_rootdir_relpath(config, item.fspath)}::{item.nodeid.split('::', 1)[1]}"
+    return item.nodeid
+
+
+def store_lint_failures(config, session, issues: "Issues", started: float) -> None:
+    """
+    Stores node ids with issues; records of files out of the checked paths are kept.
+    """
+    cache = getattr(config, "cache", None)
+    if cache is None:
+        return
+    scope = get_session_paths(session)
+    last_run = cache.get(LINT_LF_CACHE_KEY, {})
+    nodeids = {
+        nodeid
+        for nodeid in last_run.get("nodeids", [])
+        if not is_path_in_scope(get_nodeid_path(config, nodeid), scope)
+    }
+    for _, items in issues.get_items_by_rule():
+        nodeids.update(get_rootdir_nodeid(config, item) for item in items)
+    cache.set(LINT_LF_CACHE_KEY, {"timestamp": started, "nodeids": sorted(nodeids)})
+
+
 def get_items(session):
     seen_classes = {None}
     seen_functions = {None}
@@ -233,14 +741,35 @@ def get_function_name(func):
 
 
 class Issues:
-    not_classified_functions: List = []
-    no_feature_classes: List = []
-    no_story_functions: List = []
-    no_title_functions: List = []
+    not_classified_functions: List
+    no_feature_classes: List
+    no_story_functions: List
+    no_title_functions: List
+    no_title_gherkin_elements: List
+    no_tags_gherkin_elements: List
+    undecodable_gherkin_files: List
+
+    def __init__(self):
+        self.not_classified_functions = []
+        self.no_feature_classes = []
+        self.no_story_functions = []
+        self.no_title_functions = []
+        self.no_title_gherkin_elements = []
+        self.no_tags_gherkin_elements = []
+        self.undecodable_gherkin_files = []
 
     def are_exists(self):
-        return bool(
-            self.not_classified_functions + self.no_feature_classes + self.no_story_functions + self.no_title_functions
+        return any(items for _, items in self.get_items_by_rule())
+
+    def get_items_by_rule(self):
+        return (
+            (LintRule.NOT_CLASSIFIED_FUNCTION, self.not_classified_functions),
+            (LintRule.NO_FEATURE_CLASS, self.no_feature_classes),
+            (LintRule.NO_STORY_FUNCTION, self.no_story_functions),
+            (LintRule.NO_TITLE_FUNCTION, self.no_title_functions),
+            (LintRule.NO_TITLE_GHERKIN_ELEMENT, self.no_title_gherkin_elements),
+            (LintRule.NO_TAGS_GHERKIN_ELEMENT, self.no_tags_gherkin_elements),
+            (LintRule.UNDECODABLE_GHERKIN_FILE, self.undecodable_gherkin_files),
         )
 
 
@@ -295,17 +824,89 @@ class AllureComparison(BaseModel):
             return str(obj)
 
     @classmethod
-    def attach_as_is(cls, obj, name):
-        allure.attach(cls.extract_recursively(obj), name, allure.attachment_type.JSON)
-
-    def compile_allure_step(self):
+    def attach_as_is(cls, obj, name, on_attached: Optional[Callable[[int], None]] = None):
+        body = cls.extract_recursively(obj)
+        allure.attach(body, name, allure.attachment_type.JSON)
+        if on_attached is not None:
+            on_attached(len(body.encode("utf-8")))
+
+    def is_attachable(self):
+        return self.is_str_longer_than_max_len(str(self.left)) or self.is_str_longer_than_max_len(str(self.right))
+
+    def compile_allure_step(
+        self,
+        writer: Optional["AttachmentsWriter"] = None,
+        on_attached: Optional[Callable[[int], None]] = None,
+        context: Optional["AssertStepsContext"] = None,
+    ):
+        if context is not None and context.is_concurrent() and context.test_result is not None:
+            self.compile_bound_allure_step(context, writer=writer, on_attached=on_attached)
+            return
+        attach = writer.attach if writer is not None else self.attach_as_is
         with pytest.raises(AssertionError):
             with allure.step(self.get_allure_step_description()):
-                if self.is_str_longer_than_max_len(str(self.left)) or self.is_str_longer_than_max_len(str(self.right)):
-                    self.attach_as_is(self.left, "Left")
-                    self.attach_as_is(self.right, "Right")
+                if self.is_attachable():
+                    attach(self.left, "Left", on_attached)
+                    attach(self.right, "Right", on_attached)
                 raise AssertionError
 
+    def compile_bound_allure_step(
+        self,
+        context: "AssertStepsContext",
+        writer: Optional["AttachmentsWriter"] = None,
+        on_attached: Optional[Callable[[int], None]] = None,
+    ):
+        """
+        Builds failed Allure step and appends it to the owning test of the context directly,
+        so Allure's per thread steps stack is not involved and the step could not be moved
+        to another test running concurrently in other thread or asyncio task.
+        Step has the same status details as the step compiled with 'allure.step',
+        but Allure 'start_step' and 'stop_step' hooks are not called for it, so it is used
+        only for steps created outside the thread of the test or in its concurrent asyncio tasks.
+        """
+        try:
+            raise AssertionError
+        except AssertionError as e:
+            status_details = get_status_details(AssertionError, e, e.__traceback__)
+        step = TestStepResult(
+            name=self.get_allure_step_description(),
+            status=Status.FAILED,
+            statusDetails=status_details,
+            start=now(),
+            stop=now(),
+        )
+        if self.is_attachable():
+            for obj, name in ((self.left, "Left"), (self.right, "Right")):
+                file_name = self.add_attachment(step, name)
+                if writer is not None:
+                    writer.submit(obj, file_name, on_attached)
+                else:
+                    self.write_attachment(obj, file_name, on_attached)
+        context.append_step(step)
+
+    @staticmethod
+    def add_attachment(parent: ExecutableItem, name: str) -> str:
+        """
+        Adds JSON attachment to Allure step or test and returns file name for its body.
+        """
+        file_name = ATTACHMENT_PATTERN.format(prefix=uuid4(), ext=allure.attachment_type.JSON.extension)
+        parent.attachments.append(Attachment(name=name, source=file_name, type=allure.attachment_type.JSON.mime_type))
+        return file_name
+
+    @classmethod
+    def serialize(cls, obj) -> bytes:
+        return cls.extract_recursively(obj).encode("utf-8")
+
+    @staticmethod
+    def report_attachment(body: bytes, file_name, on_attached: Optional[Callable[[int], None]] = None):
+        allure_commons.plugin_manager.hook.report_attached_data(body=body, file_name=file_name)
+        if on_attached is not None:
+            on_attached(len(body))
+
+    @classmethod
+    def write_attachment(cls, obj, file_name, on_attached: Optional[Callable[[int], None]] = None):
+        cls.report_attachment(cls.serialize(obj), file_name, on_attached)
+
     def get_pytest_assertrepr(self):
         return [
             f'"{self.left} {self.op} {self.right}"',
@@ -313,20 +914,671 @@ class AllureComparison(BaseModel):
         ]
 
 
-def get_not_marked_items(config, session) -> Issues:
+class AttachmentsWriter:
+    """
+    Background writer for '--assert-steps' attachments.
+    Attachment is bound to the current Allure step synchronously in the test thread,
+    so it always belongs to the right test and step. Operand is serialized in the test thread,
+    so later mutations of it do not change the attachment. Only writing of the attachment file
+    is done by the worker thread through bounded queue: when the queue is full,
+    the test thread waits for the worker instead of growing memory.
+    """
+
+    def __init__(self, config, maxsize: int = ATTACHMENTS_QUEUE_MAX_SIZE):
+        self._config = config
+        self._queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._errors: List[Exception] = []
+
+    def attach(self, obj, name, on_attached: Optional[Callable[[int], None]] = None):
+        listener = self._config.pluginmanager.get_plugin(ALLURE_LISTENER_PLUGIN_NAME)
+        if listener is None:
+            AllureComparison.attach_as_is(obj, name, on_attached)
+            return
+        file_name = AllureComparison.add_attachment(listener.allure_logger.get_last_item(ExecutableItem), name)
+        self.submit(obj, file_name, on_attached)
+
+    def submit(self, obj, file_name, on_attached: Optional[Callable[[int], None]] = None):
+        body = AllureComparison.serialize(obj)
+        self._ensure_started()
+        self._queue.put((body, file_name, on_attached))
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, name=ATTACHMENTS_WRITER_THREAD_NAME, daemon=True)
+                self._thread.start()
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                AllureComparison.report_attachment(*task)
+            except Exception as e:
+                self._errors.append(e)
+            finally:
+                self._queue.task_done()
+
+    def flush(self):
+        if self._thread is not None:
+            self._queue.join()
+        for error in self._errors:
+            warnings.warn(f"Could not write '{Options.ASSERT_STEPS}' attachment: {error!r}", UserWarning)
+        self._errors.clear()
+
+    def shutdown(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+        self.flush()
+
+    @pytest.hookimpl(trylast=True)
+    def pytest_sessionfinish(self):
+        self.flush()
+
+    def pytest_unconfigure(self):
+        self.shutdown()
+
+
+class _TestStepsUsage:
+    def __init__(self, nodeid: str):
+        self.nodeid = nodeid
+        self.seen = 0
+        self.dropped = 0
+        self.bytes = 0
+
+
+class AssertStepsBudget:
+    """
+    Limits of '--assert-steps' capture per test and per session.
+    Budget is checked before each Allure step: when it is exhausted, the step is not compiled at all.
+    Attachment sizes are accounted after they are written, so a budget could be exceeded
+    by attachments of the last allowed step (or by queued attachments with '--assert-steps-async').
+    """
+
+    def __init__(self, config):
+        self._max_per_test: Optional[int] = config.option.assert_steps_max_per_test
+        self._max_bytes_per_test: Optional[int] = config.option.assert_steps_max_bytes_per_test
+        self._max_bytes_per_session: Optional[int] = config.option.assert_steps_max_bytes_per_session
+        self._sample_every: Optional[int] = config.option.assert_steps_sample_every
+        self._lock = threading.Lock()
+        self._session_bytes = 0
+        self._usage = _TestStepsUsage(nodeid="")
+        self._dropped: Dict[str, int] = {}
+
+    def _is_bytes_exhausted(self, usage: _TestStepsUsage) -> bool:
+        if self._max_bytes_per_session is not None and self._session_bytes >= self._max_bytes_per_session:
+            return True
+        return self._max_bytes_per_test is not None and usage.bytes >= self._max_bytes_per_test
+
+    def _is_sampled(self, usage: _TestStepsUsage) -> bool:
+        if self._max_per_test is None or usage.seen <= self._max_per_test:
+            return True
+        return bool(self._sample_every) and (usage.seen - self._max_per_test) % self._sample_every == 0
+
+    def acquire(self, usage: Optional[_TestStepsUsage] = None) -> Optional[Callable[[int], None]]:
+        """
+        Returns callback for attachments size accounting if step is allowed, otherwise None.
+        Usage of the owning test should be passed for steps from concurrently running tests,
+        otherwise the last started test is charged.
+        """
+        if usage is None:
+            usage = self._usage
+        with self._lock:
+            usage.seen += 1
+            if self._is_bytes_exhausted(usage) or not self._is_sampled(usage):
+                usage.dropped += 1
+                self._dropped[usage.nodeid] = usage.dropped
+                return None
+        return lambda size: self._account(usage, size)
+
+    def _account(self, usage: _TestStepsUsage, size: int) -> None:
+        with self._lock:
+            usage.bytes += size
+            self._session_bytes += size
+
+    def pytest_runtest_logstart(self, nodeid):
+        self._usage = _TestStepsUsage(nodeid=nodeid)
+
+    def pytest_terminal_summary(self, config):
+        if not self._dropped:
+            return
+        tw = _pytest.config.create_terminal_writer(config)
+        tw.line()
+        tw.line(
+            ASSERT_STEPS_BUDGET_HEADLINE.format(dropped=sum(self._dropped.values()), tests=len(self._dropped)),
+            yellow=True,
+        )
+        for nodeid, dropped in self._dropped.items():
+            tw.line(f"Test: '{nodeid}', dropped steps: {dropped}")
+
+
+class AssertStepsContext:
+    """
+    Owning test of '--assert-steps' Allure steps.
+    Context is bound to the test in 'pytest_runtest_protocol' hook through context variable, so it is inherited
+    by asyncio tasks of the test and could be passed into other threads with 'bind_assert_steps'.
+    Allure result of the test is resolved lazily in the thread of the test: Allure starts the test
+    in its own 'pytest_runtest_protocol' hook, which is not guaranteed to run before the one of this plugin.
+    """
+
+    def __init__(self, nodeid: str, test_result: Optional[TestResult] = None, reporter=None):
+        self.nodeid = nodeid
+        self._test_result = test_result
+        self.usage = _TestStepsUsage(nodeid=nodeid)
+        self._reporter = reporter
+        self._thread_id = threading.get_ident()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_item(cls, item) -> "AssertStepsContext":
+        listener = item.config.pluginmanager.get_plugin(ALLURE_LISTENER_PLUGIN_NAME)
+        if listener is None:
+            return cls(nodeid=item.nodeid)
+        return cls(nodeid=item.nodeid, reporter=listener.allure_logger)
+
+    @property
+    def test_result(self) -> Optional[TestResult]:
+        self._resolve_test_result()
+        return self._test_result
+
+    def _resolve_test_result(self) -> None:
+        if self._test_result is None and self._reporter is not None and self.is_owner_thread():
+            self._test_result = self._reporter.get_test(None)
+
+    def is_owner_thread(self) -> bool:
+        return threading.get_ident() == self._thread_id
+
+    def is_concurrent(self) -> bool:
+        """
+        Checks whether the step is created outside the thread of the test or in one of concurrent asyncio tasks,
+        so Allure's per thread steps stack could not be used for it.
+        """
+        return not self.is_owner_thread() or is_concurrent_task()
+
+    def _get_parent(self) -> ExecutableItem:
+        """
+        Returns the innermost Allure step opened in the current asyncio task or thread (see 'AllureStepsTracker'),
+        or the running fixture of the test, or the test itself.
+        """
+        parents = _ASSERT_STEPS_PARENTS.get()
+        if parents:
+            return parents[-1][1]
+        if self._reporter is not None and self.is_owner_thread():
+            item = self._reporter.get_last_item(ExecutableItem)
+            if isinstance(item, (TestBeforeResult, TestAfterResult)):
+                return item
+        return self.test_result
+
+    def append_step(self, step: TestStepResult) -> None:
+        with self._lock:
+            self._get_parent().steps.append(step)
+
+    def bind(self, func: Callable) -> Callable:
+        self._resolve_test_result()
+        parents = _ASSERT_STEPS_PARENTS.get()
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            token = _ASSERT_STEPS_CONTEXT.set(self)
+            parents_token = _ASSERT_STEPS_PARENTS.set(parents)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _ASSERT_STEPS_PARENTS.reset(parents_token)
+                _ASSERT_STEPS_CONTEXT.reset(token)
+
+        return wrapper
+
+
+def is_concurrent_task() -> bool:
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        return False
+    return task is not None and any(other is not task for other in asyncio.all_tasks())
+
+
+_ASSERT_STEPS_CONTEXT: "contextvars.ContextVar[Optional[AssertStepsContext]]" = contextvars.ContextVar(
+    "markers_presence_assert_steps_context", default=None
+)
+_ASSERT_STEPS_PARENTS: "contextvars.ContextVar[Tuple[Tuple[Any, TestStepResult], ...]]" = contextvars.ContextVar(
+    "markers_presence_assert_steps_parents", default=()
+)
+
+
+class AllureStepsTracker:
+    """
+    Tracks Allure steps opened with 'allure.step' per asyncio task and thread: Allure's own steps stack is per thread,
+    so steps of concurrent asyncio tasks are interleaved in it. Stack of opened steps is kept in context variable,
+    which is copied into every asyncio task, and it is used as parents of '--assert-steps' steps.
+    """
+
+    def __init__(self, config):
+        self._config = config
+
+    @allure_commons.hookimpl(hookwrapper=True)
+    def start_step(self, uuid):
+        yield
+        listener = self._config.pluginmanager.get_plugin(ALLURE_LISTENER_PLUGIN_NAME)
+        step = listener.allure_logger.get_item(uuid) if listener is not None else None
+        if isinstance(step, TestStepResult):
+            _ASSERT_STEPS_PARENTS.set((*_ASSERT_STEPS_PARENTS.get(), (uuid, step)))
+
+    @allure_commons.hookimpl(hookwrapper=True)
+    def stop_step(self, uuid):
+        yield
+        parents = _ASSERT_STEPS_PARENTS.get()
+        if any(parent_uuid == uuid for parent_uuid, _ in parents):
+            _ASSERT_STEPS_PARENTS.set(tuple(parent for parent in parents if parent[0] != uuid))
+
+
+def get_assert_steps_context() -> Optional[AssertStepsContext]:
+    return _ASSERT_STEPS_CONTEXT.get()
+
+
+def bind_assert_steps(func: Callable) -> Callable:
+    """
+    Binds function to '--assert-steps' context of the current test, e.g. before submitting it into thread pool:
+    threads do not inherit context variables, so assertion steps of the function would not find their test.
+    """
+    context = get_assert_steps_context()
+    if context is None:
+        return func
+    return context.bind(func)
+
+
+class LintRule(str, enum.Enum):
+    NOT_CLASSIFIED_FUNCTION = "not-classified-function"
+    NO_FEATURE_CLASS = "no-feature-class"
+    NO_STORY_FUNCTION = "no-story-function"
+    NO_TITLE_FUNCTION = "no-title-function"
+    NO_TITLE_GHERKIN_ELEMENT = "no-title-gherkin-element"
+    NO_TAGS_GHERKIN_ELEMENT = "no-tags-gherkin-element"
+    UNDECODABLE_GHERKIN_FILE = "undecodable-gherkin-file"
+
+    def __str__(self):
+        return str(self.value)
+
+
+@dataclass(frozen=True)
+class LintOptions:
+    bdd_format: bool = False
+    feature_title: bool = False
+    pytest_args: Tuple[str, ...] = ()
+    baseline: Optional[str] = None
+    baseline_update: bool = False
+    gherkin_features: bool = False
+    gherkin_feature_tags: Tuple[str, ...] = ()
+    gherkin_scenario_tags: Tuple[str, ...] = ()
+
+
+@dataclass(frozen=True)
+class LintViolation:
+    rule: LintRule
+    name: str
+    nodeid: str
+    location: str
+
+
+@dataclass(frozen=True)
+class LintResult:
+    violations: List[LintViolation]
+    collection_errors: int = 0
+
+    @property
+    def failed(self) -> bool:
+        return bool(self.violations) or bool(self.collection_errors)
+
+
+def get_lint_options(config) -> LintOptions:
+    return LintOptions(
+        bdd_format=config.option.bdd_markers,
+        feature_title=config.option.feature_title,
+        baseline=config.option.markers_baseline,
+        gherkin_features=config.option.gherkin_features,
+        gherkin_feature_tags=tuple(config.getini("gherkin_feature_tags")),
+        gherkin_scenario_tags=tuple(config.getini("gherkin_scenario_tags")),
+    )
+
+
+def get_issues(session, options: LintOptions) -> Issues:
     issues = Issues()
     for cls, func in get_items(session):
         if cls and not detect_excluded_markers(cls):
             include_if_class_without_feature(cls, issues.no_feature_classes)
         if not detect_excluded_markers(func) and not is_parent_excluded(func):
             include_if_function_without_class(func, issues.not_classified_functions)
-            if config.option.bdd_markers:
+            if options.bdd_format:
                 include_if_function_without_story(func, issues.no_story_functions)
-            if config.option.feature_title:
+            if options.feature_title:
                 include_if_function_without_title(func, issues.no_title_functions)
+    if options.gherkin_features:
+        include_gherkin_issues(get_session_paths(session), options, issues)
     return issues
 
 
+@dataclass(frozen=True)
+class GherkinElement:
+    keyword: str
+    name: str
+    tags: List[str]
+    fspath: Any
+    line: int
+    index: int = 0
+
+    @property
+    def nodeid(self) -> str:
+        return f"{CURDIR.bestrelpath(self.fspath)}::{self.keyword}::{self.name}"
+
+
+class GherkinDecodeError(ValueError):
+    def __init__(self, path, line: int):
+        super().__init__(f"Could not decode line {line} of '{path}' as UTF-8")
+        self.path = path
+        self.line = line
+
+
+def scan_feature_file(path) -> Iterator[GherkinElement]:
+    """
+    Streaming line-by-line scanner of Gherkin file: only features and scenarios with their titles and tags
+    are extracted (scenario inherits tags of its feature and rule), steps and tables are skipped.
+    Index of element counts previous elements with the same keyword and title, so untitled scenarios differ.
+    Lines are decoded one by one, so 'GherkinDecodeError' points to the first line which is not UTF-8.
+    """
+    pending_tags: List[str] = []
+    feature_tags: List[str] = []
+    rule_tags: List[str] = []
+    docstring_delimiter = None
+    seen: Dict[Tuple[str, str], int] = {}
+
+    def make_element(keyword: str, name: str, tags: List[str], number: int) -> GherkinElement:
+        index = seen.get((keyword, name), 0)
+        seen[(keyword, name)] = index + 1
+        return GherkinElement(keyword=keyword, name=name, tags=tags, fspath=path, line=number, index=index)
+
+    with open(str(path), "rb") as feature_file:
+        for number, raw_line in enumerate(feature_file, start=1):
+            try:
+                line = raw_line.decode("utf-8").strip()
+            except UnicodeDecodeError:
+                raise GherkinDecodeError(path, number) from None
+            if docstring_delimiter is not None:
+                if line.startswith(docstring_delimiter):
+                    docstring_delimiter = None
+                continue
+            if line.startswith(GHERKIN_DOCSTRING_DELIMITERS):
+                docstring_delimiter = line[:3]
+                continue
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("@"):
+                pending_tags.extend(tag[1:] for tag in line.split(" #", 1)[0].split() if tag.startswith("@"))
+                continue
+            if line.startswith(GHERKIN_FEATURE_PREFIXES):
+                feature_tags, rule_tags = pending_tags, []
+                yield make_element(GHERKIN_FEATURE_KEYWORD, line.split(":", 1)[1].strip(), feature_tags, number)
+            elif line.startswith(GHERKIN_RULE_PREFIXES):
+                rule_tags = pending_tags
+            elif line.startswith(GHERKIN_SCENARIO_PREFIXES):
+                yield make_element(
+                    GHERKIN_SCENARIO_KEYWORD,
+                    line.split(":", 1)[1].strip(),
+                    feature_tags + rule_tags + pending_tags,
+                    number,
+                )
+            pending_tags = []
+
+
+def get_session_paths(session) -> List[str]:
+    return [arg.split("::", 1)[0] for arg in session.config.args]
+
+
+def is_path_in_scope(path: str, scope: Optional[Sequence[str]]) -> bool:
+    if scope is None:
+        return True
+    path = os.path.normpath(os.path.join(CURDIR.strpath, path))
+    for root in scope:
+        root = os.path.normpath(os.path.join(CURDIR.strpath, root))
+        if path == root or path.startswith(root.rstrip(os.sep) + os.sep):
+            return True
+    return False
+
+
+def iter_feature_files(paths: Sequence[str]):
+    for path in map(py.path.local, paths):
+        if path.check(file=True) and path.fnmatch(GHERKIN_FILE_PATTERN):
+            yield path
+        elif path.check(dir=True):
+            yield from path.visit(fil=GHERKIN_FILE_PATTERN, rec=_is_suitable_dir, sort=True)
+
+
+def get_missing_gherkin_tags(element: GherkinElement, options: LintOptions) -> List[str]:
+    if element.keyword == GHERKIN_FEATURE_KEYWORD:
+        required = options.gherkin_feature_tags
+    else:
+        required = options.gherkin_scenario_tags
+    return [tag for tag in required if tag not in element.tags]
+
+
+def include_gherkin_issues(paths: Sequence[str], options: LintOptions, issues: Issues) -> None:
+    for path in iter_feature_files(paths):
+        try:
+            for element in scan_feature_file(path):
+                if GHERKIN_EXCLUDED_TAG in to_upper_case(element.tags):
+                    continue
+                if not element.name:
+                    issues.no_title_gherkin_elements.append(element)
+                if get_missing_gherkin_tags(element, options):
+                    issues.no_tags_gherkin_elements.append(element)
+        except GherkinDecodeError as e:
+            issues.undecodable_gherkin_files.append(
+                GherkinElement(keyword=GHERKIN_FILE_KEYWORD, name=path.basename, tags=[], fspath=path, line=e.line)
+            )
+
+
+def get_not_marked_items(config, session) -> Issues:
+    return get_issues(session, get_lint_options(config))
+
+
+def get_item_relpath(item) -> str:
+    """
+    Legacy 'Node.fspath' property is removed on config cleanup, so it is missing for items of finished sessions,
+    e.g. returned by 'collect_session'; 'Node.path' is used for pytest items, Gherkin elements have only 'fspath'.
+    """
+    path = item.path if hasattr(item, "path") else item.fspath
+    return CURDIR.bestrelpath(py.path.local(path))
+
+
+def get_violations(issues: Issues) -> List[LintViolation]:
+    return [
+        LintViolation(rule=rule, name=get_function_name(item), nodeid=item.nodeid, location=get_item_relpath(item))
+        for rule, items in issues.get_items_by_rule()
+        for item in items
+    ]
+
+
+class LintBaseline:
+    """
+    Baseline of known linter issues for ratcheting of legacy test suites.
+    File contains sorted hashes of (rule, nodeid without parameters) pairs with file paths, one per line,
+    so the membership of every issue is checked with set lookup. Hashes of Gherkin elements also include
+    index of the element, so elements with the same title (e.g. untitled ones) in one file do not collide.
+    Fixed issues are dropped from the file when there are no new issues; only issues from files
+    in checked paths are considered, so partial runs do not drop issues of other files,
+    and issues of tests deselected with '-k', '-m' or sharding options are kept too.
+    """
+
+    def __init__(self, path: str, read_only: bool = False):
+        self._path = path
+        self._read_only = read_only
+        self.suppressed = 0
+        self.fixed = 0
+        self.written: Optional[int] = None
+
+    @staticmethod
+    def get_nodeid_hash(rule: LintRule, nodeid: str) -> str:
+        nodeid = nodeid.split("[", 1)[0]
+        return hashlib.sha1(f"{rule}:{nodeid}".encode("utf-8")).hexdigest()[:MARKERS_BASELINE_HASH_LENGTH]
+
+    @classmethod
+    def get_hash(cls, rule: LintRule, item) -> str:
+        if isinstance(item, GherkinElement):
+            key = f"{rule}:{item.nodeid}:{item.index}"
+            return hashlib.sha1(key.encode("utf-8")).hexdigest()[:MARKERS_BASELINE_HASH_LENGTH]
+        return cls.get_nodeid_hash(rule, item.nodeid)
+
+    def _load(self) -> Optional[Dict[str, str]]:
+        entries = {}
+        try:
+            with open(self._path, encoding="utf-8") as baseline_file:
+                for number, line in enumerate(baseline_file, start=1):
+                    if not line.strip():
+                        continue
+                    entry = line.strip().split(" ", 1)
+                    if len(entry) != 2 or len(entry[0]) != MARKERS_BASELINE_HASH_LENGTH:
+                        raise pytest.UsageError(MARKERS_BASELINE_USAGE_ERROR.format(path=self._path, line=number))
+                    entries[entry[0]] = entry[1]
+        except FileNotFoundError:
+            return None
+        return entries
+
+    def _write(self, entries: Dict[str, str]) -> None:
+        if self._read_only:
+            return
+        with open(self._path, "w", encoding="utf-8") as baseline_file:
+            baseline_file.writelines(f"{h} {path}\n" for h, path in sorted(entries.items()))
+        self.written = len(entries)
+
+    def apply(
+        self,
+        issues: Issues,
+        update: bool = False,
+        scope: Optional[Sequence[str]] = None,
+        deselected: Collection[str] = (),
+    ) -> Issues:
+        """
+        Returns issues which are not recorded in baseline.
+        Scope is the list of checked paths, the whole baseline is in scope by default.
+        Issues of deselected node ids are out of scope even in checked paths.
+        """
+        hashes = {}
+        current = {}
+        for rule, items in issues.get_items_by_rule():
+            for item in items:
+                hashes[(rule, item.nodeid)] = self.get_hash(rule, item)
+                current[hashes[(rule, item.nodeid)]] = get_item_relpath(item)
+
+        known = self._load()
+        if known is None and self._read_only and not update:
+            known = {}
+        if known is None:
+            self._write(current)
+            return Issues()
+        deselected_hashes = {self.get_nodeid_hash(rule, nodeid) for nodeid in deselected for rule in LintRule}
+        out_of_scope = {
+            h: path for h, path in known.items() if h in deselected_hashes or not is_path_in_scope(path, scope)
+        }
+        if update:
+            self._write({**out_of_scope, **current})
+            return Issues()
+
+        new_issues = Issues()
+        for (rule, items), (_, new_items) in zip(issues.get_items_by_rule(), new_issues.get_items_by_rule()):
+            for item in items:
+                if hashes[(rule, item.nodeid)] in known:
+                    self.suppressed += 1
+                else:
+                    new_items.append(item)
+        self.fixed = len(known.keys() - current.keys() - out_of_scope.keys())
+        if self.fixed and not new_issues.are_exists():
+            self._write({**out_of_scope, **current})
+        return new_issues
+
+    def write_summary(self, tw) -> None:
+        if self.written is not None and not self.suppressed:
+            tw.line(MARKERS_BASELINE_WRITTEN_HEADLINE.format(path=self._path, count=self.written), yellow=True)
+            return
+        tw.line(
+            MARKERS_BASELINE_HEADLINE.format(path=self._path, suppressed=self.suppressed, fixed=self.fixed),
+            yellow=True,
+        )
+
+
+class _SessionCatcher:
+    session: Optional[pytest.Session] = None
+
+    def __init__(self, paths: Sequence[str]):
+        self._paths = paths
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_load_initial_conftests(self, early_config):
+        evict_modules(self._paths, [CONFTEST_FILE_NAME, *early_config.getini("python_files")])
+
+    def pytest_collection_finish(self, session):
+        self.session = session
+
+
+def evict_modules(paths: Sequence[str], patterns: Sequence[str]) -> None:
+    """
+    Removes already imported modules from the paths, which are matched by patterns (test modules and conftests),
+    so they are imported again and their changes are seen by next collection.
+    Other modules (tested packages, plugins, site-packages in the paths) are kept.
+    """
+    roots = [os.path.abspath(str(path).split("::", 1)[0]) for path in paths]
+    for name, module in list(sys.modules.items()):
+        file = getattr(module, "__file__", None)
+        if not file or not is_path_in_scope(file, roots):
+            continue
+        if any(py.path.local(file).fnmatch(pattern) for pattern in patterns):
+            del sys.modules[name]
+    importlib.invalidate_caches()
+
+
+def collect_session(paths: Sequence[str], pytest_args: Sequence[str] = ()) -> pytest.Session:
+    """
+    Collects tests in current process without running them and without terminal output.
+    Plugins are reused between calls, so repeated collection does not pay interpreter startup and plugins import,
+    but test modules and conftests from the paths are imported again.
+    """
+    catcher = _SessionCatcher(paths)
+    with contextlib.redirect_stdout(io.StringIO()):
+        pytest.main([*map(str, paths), "--collect-only", "-q", *pytest_args], plugins=[catcher])
+    if catcher.session is None:
+        raise pytest.UsageError(f"Could not collect tests from {list(paths)}!")
+    return catcher.session
+
+
+def lint(
+    target: Union[pytest.Session, str, os.PathLike, Sequence[str]], options: Optional[LintOptions] = None
+) -> LintResult:
+    """
+    Programmatic version of '--bdd-format' and '--feature-title' checking.
+    Target could be already collected pytest session (for example, from 'pytest_collection_finish' hook)
+    or paths for in-process collection.
+    """
+    if options is None:
+        options = LintOptions()
+    if isinstance(target, pytest.Session):
+        session = target
+    else:
+        session = collect_session([target] if isinstance(target, (str, os.PathLike)) else target, options.pytest_args)
+    issues = get_issues(session, options)
+    if options.baseline:
+        issues = LintBaseline(options.baseline, read_only=not options.baseline_update).apply(
+            issues,
+            update=options.baseline_update,
+            scope=get_session_paths(session),
+            deselected=get_deselected_nodeids(session),
+        )
+    return LintResult(violations=get_violations(issues), collection_errors=session.testsfailed)
+
+
 def _is_suitable_dir(name: str) -> bool:
     for pattern in _DIR_SUPPORTED_PATTERNS:
         if name.fnmatch(pattern):
@@ -335,7 +1587,50 @@ def _is_suitable_dir(name: str) -> bool:
     return True
 
 
-def mark_tests_by_location(session, config) -> None:
+@dataclass(frozen=True)
+class StagingManifest:
+    tests_dir: str
+    staging_markers: List[str]
+    fingerprints: Dict[str, int]
+    stages: Dict[str, str]
+
+
+def get_dirs_fingerprints(test_dir, staging_markers: List[str]) -> Dict[str, int]:
+    """
+    Directory mtime changes when its subfolders are added, removed or renamed,
+    so a few 'stat' calls are enough to check that staging markers are still the same.
+    """
+    fingerprints = {"": os.stat(test_dir.strpath).st_mtime_ns}
+    for marker in staging_markers:
+        fingerprints[marker] = os.stat(test_dir.join(marker).strpath).st_mtime_ns
+    return fingerprints
+
+
+def load_staging_manifest(path: str) -> Optional[StagingManifest]:
+    try:
+        with open(path, encoding="utf-8") as manifest_file:
+            manifest = StagingManifest(**json.load(manifest_file))
+        if manifest.tests_dir != CURDIR.join(CORRECT_TESTS_FOLDER_PATTERN).strpath:
+            return None
+        if get_dirs_fingerprints(py.path.local(manifest.tests_dir), manifest.staging_markers) != manifest.fingerprints:
+            return None
+    except (OSError, ValueError, TypeError):
+        return None
+    return manifest
+
+
+def write_staging_manifest(path: str, manifest: StagingManifest) -> None:
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as manifest_file:
+        json.dump(asdict(manifest), manifest_file, sort_keys=True, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def get_stage_by_location(item, test_dir, staging_markers: List[str]) -> Optional[str]:
+    return next((m for m in staging_markers if test_dir.join(m).strpath in item.fspath.strpath), None)
+
+
+def get_staging_markers(config):
     try:
         test_dir = next(
             iter(CURDIR.listdir(fil=lambda x: x.check(dir=True) and x.fnmatch(CORRECT_TESTS_FOLDER_PATTERN)))
@@ -346,33 +1641,54 @@ def mark_tests_by_location(session, config) -> None:
                 f"Could not find folder '{CORRECT_TESTS_FOLDER_PATTERN}' in '{CURDIR.strpath}'!",
                 UserWarning,
             )
-        return
+        return None, []
 
     staging_markers = [d.basename for d in test_dir.listdir(fil=lambda x: x.check(dir=True) and _is_suitable_dir(x))]
+    return test_dir, staging_markers
+
+
+def warn_about_staging_markers(config, test_dir, staging_markers: List[str]) -> None:
+    if not config.option.staging_warnings:
+        return
     if not staging_markers:
-        if config.option.staging_warnings:
-            warnings.warn(
-                f"No one subfolder was found in '{test_dir.basename}' folder, so test markers had not been generated!",
-                UserWarning,
-            )
+        warnings.warn(
+            f"No one subfolder was found in '{test_dir.basename}' folder, so test markers had not been generated!",
+            UserWarning,
+        )
         return
+    if len(staging_markers) < MIN_TESTS_SUBFOLDERS_NUM:
+        warnings.warn(
+            f"You should have at least {MIN_TESTS_SUBFOLDERS_NUM} directories for tests to make staging better.",
+            UserWarning,
+        )
+    if UNIT_TESTS_MARKER not in to_upper_case(staging_markers):
+        warnings.warn(
+            f"Does your project really contain no '{UNIT_TESTS_MARKER}' tests? Amazing.",
+            UserWarning,
+        )
 
-    if config.option.staging_warnings:
-        if len(staging_markers) < MIN_TESTS_SUBFOLDERS_NUM:
-            warnings.warn(
-                f"You should have at least {MIN_TESTS_SUBFOLDERS_NUM} directories for tests to make staging better.",
-                UserWarning,
-            )
-        if UNIT_TESTS_MARKER not in to_upper_case(staging_markers):
-            warnings.warn(
-                f"Does your project really contain no '{UNIT_TESTS_MARKER}' tests? Amazing.",
-                UserWarning,
-            )
 
+def mark_tests_by_location(session, config) -> Dict[str, str]:
+    manifest_path = config.option.staging_manifest
+    manifest = load_staging_manifest(manifest_path) if manifest_path else None
+    if manifest is not None:
+        test_dir, staging_markers = py.path.local(manifest.tests_dir), manifest.staging_markers
+        known_stages = manifest.stages
+    else:
+        test_dir, staging_markers = get_staging_markers(config)
+        if test_dir is None:
+            return {}
+        known_stages = {}
+    warn_about_staging_markers(config, test_dir, staging_markers)
+    if not staging_markers:
+        return {}
+
+    stages = {}
     for item in session.items:
-        try:
-            marker = next(m for m in staging_markers if test_dir.join(m).strpath in item.fspath.strpath)
-        except StopIteration:
+        marker = known_stages.get(item.nodeid)
+        if marker is None:
+            marker = get_stage_by_location(item, test_dir, staging_markers)
+        if marker is None:
             if config.option.staging_warnings:
                 warnings.warn(
                     f"Could not add item for test function '{get_function_name(item)}'! Please, place your function "
@@ -382,6 +1698,450 @@ def mark_tests_by_location(session, config) -> None:
                 )
             continue
         item.add_marker(marker)
+        stages[item.nodeid] = marker
+
+    if not manifest_path:
+        return stages
+    scope = get_session_paths(session)
+    manifest_stages = {
+        nodeid: marker
+        for nodeid, marker in known_stages.items()
+        if not is_path_in_scope(get_nodeid_path(config, nodeid), scope)
+    }
+    manifest_stages.update(stages)
+    if manifest is None or manifest_stages != known_stages:
+        write_staging_manifest(
+            manifest_path,
+            StagingManifest(
+                tests_dir=test_dir.strpath,
+                staging_markers=staging_markers,
+                fingerprints=get_dirs_fingerprints(test_dir, staging_markers),
+                stages=manifest_stages,
+            ),
+        )
+    return stages
+
+
+def get_scope_nodeid(item, fixturedef) -> str:
+    if fixturedef.scope == "package":
+        return fixturedef.baseid
+    if fixturedef.scope in ("module", "class"):
+        node = item.getparent(pytest.Class) if fixturedef.scope == "class" else None
+        node = node or item.getparent(pytest.Module)
+        return node.nodeid if node is not None else item.nodeid.split("::", 1)[0]
+    return ""
+
+
+def get_higher_scope_fixture_keys(
+    item, scopes: Sequence[str] = HIGHER_FIXTURE_SCOPES
+) -> Tuple[Tuple[str, str, Optional[int]], ...]:
+    """
+    Returns (name, scope node id, param index) for every fixture of the given scopes used by item.
+    """
+    fixtureinfo = getattr(item, "_fixtureinfo", None)
+    if fixtureinfo is None:
+        return ()
+    callspec = getattr(item, "callspec", None)
+    keys = []
+    for name, fixturedefs in fixtureinfo.name2fixturedefs.items():
+        if not fixturedefs or fixturedefs[-1].scope not in scopes:
+            continue
+        param_index = callspec.indices.get(name) if callspec is not None else None
+        keys.append((name, get_scope_nodeid(item, fixturedefs[-1]), param_index))
+    return tuple(sorted(keys, key=lambda key: key[0]))
+
+
+def count_fixture_setups(items) -> int:
+    """
+    Estimates session, package, module and class scoped fixtures setups for the given items order:
+    fixture is set up again when its param changes or when its scope node was left.
+    """
+    setups = 0
+    active: Dict[str, Tuple[str, Optional[int]]] = {}
+    for item in items:
+        chain = {node.nodeid for node in item.listchain()}
+        active = {name: key for name, key in active.items() if key[0] in chain}
+        for name, scope_nodeid, param_index in get_higher_scope_fixture_keys(item, NON_FUNCTION_FIXTURE_SCOPES):
+            if active.get(name) != (scope_nodeid, param_index):
+                setups += 1
+                active[name] = (scope_nodeid, param_index)
+    return setups
+
+
+class StagingReorder:
+    """
+    Groups test modules by staging marker and, within each stage, by session and package scoped fixtures
+    used by their items. Modules are moved as whole blocks, so module and class scoped fixtures stay contiguous;
+    groups follow the order of their first module, and stable sort keeps collection order inside every group.
+    Collection order is kept when reordering does not reduce estimated fixtures setups.
+    """
+
+    def __init__(self):
+        self._before = 0
+        self._after = 0
+
+    def reorder(self, items, stages: Dict[str, str]) -> None:
+        self._before = count_fixture_setups(items)
+        modules: Dict[str, Tuple[str, set]] = {}
+        for item in items:
+            module = item.nodeid.split("::", 1)[0]
+            stage, fixture_keys = modules.setdefault(module, (stages.get(item.nodeid, ""), set()))
+            fixture_keys.update(get_higher_scope_fixture_keys(item))
+        stage_ranks: Dict[str, int] = {}
+        group_ranks: Dict[Tuple[str, Tuple], int] = {}
+        module_keys = {}
+        for module, (stage, fixture_keys) in modules.items():
+            group = (stage, tuple(sorted(fixture_keys, key=str)))
+            module_keys[module] = (
+                stage_ranks.setdefault(stage, len(stage_ranks)),
+                group_ranks.setdefault(group, len(group_ranks)),
+            )
+        reordered = sorted(items, key=lambda item: module_keys[item.nodeid.split("::", 1)[0]])
+        after = count_fixture_setups(reordered)
+        if after < self._before:
+            items[:] = reordered
+        self._after = min(after, self._before)
+
+    def pytest_report_collectionfinish(self):
+        return STAGING_REORDER_REPORT.format(before=self._before, after=self._after, saved=self._before - self._after)
+
+
+class StreamingHistogram:
+    """
+    Histogram with logarithmic buckets: memory is bounded by the number of buckets between
+    HISTOGRAM_MIN_VALUE and the max value, and percentiles relative error is below the growth factor.
+    """
+
+    def __init__(self, min_value: float = HISTOGRAM_MIN_VALUE, growth_factor: float = HISTOGRAM_GROWTH_FACTOR):
+        self._min_value = min_value
+        self._growth_factor = growth_factor
+        self._log_growth_factor = math.log(growth_factor)
+        self._buckets: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def add(self, value: float) -> None:
+        if value <= self._min_value:
+            index = 0
+        else:
+            index = math.ceil(math.log(value / self._min_value) / self._log_growth_factor)
+        self._buckets[index] = self._buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, percent: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(percent / 100 * self.count))
+        seen = 0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen >= rank:
+                return max(self.min, min(self.max, self._min_value * self._growth_factor ** index))
+        return self.max
+
+    def to_dict(self) -> Dict[str, float]:
+        stats = {"count": self.count, "total": self.total, "min": self.min if self.count else 0.0, "max": self.max}
+        for percent in STAGING_DURATIONS_PERCENTILES:
+            stats[f"p{percent}"] = self.percentile(percent)
+        return stats
+
+
+class ReportStages:
+    """
+    Resolves stages of tests reports. Stages of collected items are set after collection, but 'pytest-xdist'
+    controller does not collect, so the stage of item (or its own staging marker) is stored into report
+    'user_properties', which are sent from workers. Report keywords are used only as the last resort:
+    they include names of all parents, so a directory named as other stage could be taken for the stage.
+    """
+
+    def __init__(self, config):
+        self._config = config
+        self.stages: Dict[str, str] = {}
+        self.staging_markers: Optional[List[str]] = None
+
+    def get_staging_markers(self) -> List[str]:
+        if self.staging_markers is None:
+            _, self.staging_markers = get_staging_markers(self._config)
+        return self.staging_markers
+
+    def get_item_stage(self, item) -> Optional[str]:
+        stage = self.stages.get(item.nodeid)
+        if stage is not None:
+            return stage
+        staging_markers = self.get_staging_markers()
+        return next((marker.name for marker in item.own_markers if marker.name in staging_markers), None)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_makereport(self, item):
+        outcome = yield
+        report = outcome.get_result()
+        stage = self.get_item_stage(item)
+        if stage is not None and (STAGING_STAGE_PROPERTY, stage) not in report.user_properties:
+            report.user_properties.append((STAGING_STAGE_PROPERTY, stage))
+
+    def get_report_stage(self, report) -> Optional[str]:
+        stage = self.stages.get(report.nodeid)
+        if stage is not None:
+            return stage
+        stage = next((value for name, value in report.user_properties if name == STAGING_STAGE_PROPERTY), None)
+        if stage is not None:
+            return stage
+        return next((marker for marker in self.get_staging_markers() if marker in report.keywords), None)
+
+
+class StagingDurations(ReportStages):
+    """
+    Aggregates setup, call and teardown durations of tests by staging markers.
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        self._histograms: Dict[str, Dict[str, StreamingHistogram]] = {}
+
+    def pytest_runtest_logreport(self, report):
+        stage = self.get_report_stage(report) or STAGING_DURATIONS_NO_STAGE
+        phases = self._histograms.get(stage)
+        if phases is None:
+            phases = self._histograms[stage] = {phase: StreamingHistogram() for phase in STAGING_DURATIONS_PHASES}
+        phases[report.when].add(report.duration)
+
+    def to_dict(self) -> Dict[str, Dict[str, Dict[str, float]]]:
+        return {
+            stage: {phase: histogram.to_dict() for phase, histogram in phases.items()}
+            for stage, phases in sorted(self._histograms.items())
+        }
+
+    def pytest_sessionfinish(self):
+        if self._config.option.staging_durations_json and not is_xdist_worker(self._config):
+            with open(self._config.option.staging_durations_json, "w", encoding="utf-8") as durations_file:
+                json.dump(self.to_dict(), durations_file, **JSON_DUMPS_KWARGS)
+
+    def pytest_terminal_summary(self, config):
+        if not config.option.staging_durations or not self._histograms:
+            return
+        tw = _pytest.config.create_terminal_writer(config)
+        tw.line()
+        tw.line(STAGING_DURATIONS_HEADLINE, bold=True)
+        percentiles = "".join(f"{'p' + str(percent):>10}" for percent in STAGING_DURATIONS_PERCENTILES)
+        tw.line(f"{'stage':<20}{'phase':<10}{'count':>8}{'total':>10}{percentiles}")
+        for stage, phases in self.to_dict().items():
+            for phase, stats in phases.items():
+                values = "".join(f"{stats[f'p{percent}']:>9.3f}s" for percent in STAGING_DURATIONS_PERCENTILES)
+                tw.line(f"{stage:<20}{phase:<10}{stats['count']:>8}{stats['total']:>9.2f}s{values}")
+
+
+def is_staging_budgets_set(config) -> bool:
+    return bool(config.getini("staging_test_budgets") or config.getini("staging_total_budgets"))
+
+
+def parse_staging_budgets(lines: List[str]) -> Dict[str, float]:
+    budgets = {}
+    for line in lines:
+        stage, sep, value = line.partition("=")
+        try:
+            if not sep:
+                raise ValueError
+            budgets[stage.strip()] = float(value)
+        except ValueError:
+            raise pytest.UsageError(f"Could not parse staging budget '{line}', expected format is 'stage = seconds'!")
+    return budgets
+
+
+class StagingBudgets(ReportStages):
+    """
+    Checks tests durations against per test and total budgets of their stages.
+    Per test budgets include only phases from 'staging_test_budgets_phases' ('call' by default), so a test
+    which sets up shared fixtures first is not flagged; total budgets include all phases.
+    Only total budgets fail the session by default: a single slow test on a loaded CI node is reported,
+    but it fails the session only in 'strict' mode.
+    """
+
+    def __init__(self, config):
+        super().__init__(config)
+        self._test_budgets_phases = config.getini("staging_test_budgets_phases")
+        if not set(self._test_budgets_phases) <= set(STAGING_DURATIONS_PHASES):
+            raise pytest.UsageError(
+                f"Option 'staging_test_budgets_phases' should contain only phases {STAGING_DURATIONS_PHASES}!"
+            )
+        self._test_budgets = parse_staging_budgets(config.getini("staging_test_budgets"))
+        self._total_budgets = parse_staging_budgets(config.getini("staging_total_budgets"))
+        self._mode = config.getini("staging_budgets_mode")
+        if self._mode not in STAGING_BUDGETS_MODES:
+            raise pytest.UsageError(f"Option 'staging_budgets_mode' should be one of {STAGING_BUDGETS_MODES}!")
+        self._durations: Dict[str, float] = {}
+        self._totals: Dict[str, float] = {}
+        self._slow_tests: List[Tuple[str, str, float]] = []
+
+    def pytest_runtest_logreport(self, report):
+        stage = self.get_report_stage(report)
+        if stage is None:
+            return
+        duration = self._durations.get(report.nodeid, 0.0)
+        if report.when in self._test_budgets_phases:
+            duration += report.duration
+        self._durations[report.nodeid] = duration
+        self._totals[stage] = self._totals.get(stage, 0.0) + report.duration
+        if report.when == "teardown":
+            del self._durations[report.nodeid]
+            if stage in self._test_budgets and duration > self._test_budgets[stage]:
+                self._slow_tests.append((report.nodeid, stage, duration))
+
+    def get_exceeded_stages(self) -> List[str]:
+        return [
+            stage
+            for stage, budget in self._total_budgets.items()
+            if stage in self._totals and self._totals[stage] > budget
+        ]
+
+    def is_exceeded(self) -> bool:
+        return bool(self._slow_tests) or bool(self.get_exceeded_stages())
+
+    def is_failed(self) -> bool:
+        if self._mode == "warn":
+            return False
+        return bool(self.get_exceeded_stages()) or (self._mode == "strict" and bool(self._slow_tests))
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_sessionfinish(self, session, exitstatus):
+        if exitstatus == 0 and self.is_failed():
+            session.exitstatus = ExitCodes.FAILED
+
+    def pytest_terminal_summary(self, config):
+        if not self.is_exceeded():
+            return
+        tw = _pytest.config.create_terminal_writer(config)
+        tw.line()
+        failed = self.is_failed()
+        tw.line(STAGING_BUDGETS_HEADLINE, red=failed, yellow=not failed)
+        for stage in self.get_exceeded_stages():
+            tw.line(
+                STAGING_TOTAL_BUDGET_LINE.format(
+                    stage=stage, duration=self._totals[stage], budget=self._total_budgets[stage]
+                )
+            )
+        for nodeid, stage, duration in sorted(self._slow_tests, key=lambda x: -x[2]):
+            tw.line(
+                STAGING_TEST_BUDGET_LINE.format(
+                    nodeid=nodeid, stage=stage, duration=duration, budget=self._test_budgets[stage]
+                )
+            )
+
+
+def is_sharding_enabled(config) -> bool:
+    if config.option.shard_index is None and config.option.shard_count is None:
+        return False
+    if config.option.shard_index is None or config.option.shard_count is None:
+        raise pytest.UsageError(SHARDING_USAGE_ERROR)
+    if config.option.shard_count < 1 or not 0 <= config.option.shard_index < config.option.shard_count:
+        raise pytest.UsageError(
+            f"Option '{Options.SHARD_INDEX}' should be in range from 0 to {config.option.shard_count - 1}!"
+        )
+    return True
+
+
+def is_xdist_worker(config) -> bool:
+    return hasattr(config, "workerinput")
+
+
+class DurationsRecorder:
+    """
+    Stores tests durations (setup, call and teardown) into pytest cache for next sharded runs.
+    Sharded runs only read durations: every node should see the same durations to compute the same split.
+    Recorder is registered only on 'pytest-xdist' controller, which receives reports of all workers,
+    so workers do not overwrite the cache concurrently. Durations of tests from the run paths
+    which are not collected anymore are dropped.
+    """
+
+    def __init__(self, config):
+        self._config = config
+        self._durations: Dict[str, float] = {}
+        self._collected: Set[str] = set()
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_collection_modifyitems(self, items):
+        self._collected.update(item.nodeid for item in items)
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_xdist_node_collection_finished(self, node, ids):
+        self._collected.update(ids)
+
+    def pytest_runtest_logreport(self, report):
+        self._durations[report.nodeid] = self._durations.get(report.nodeid, 0.0) + report.duration
+
+    def pytest_sessionfinish(self, session):
+        cache = getattr(self._config, "cache", None)
+        if cache is None or not self._durations:
+            return
+        scope = get_session_paths(session)
+        durations = {
+            nodeid: duration
+            for nodeid, duration in cache.get(SHARDING_DURATIONS_CACHE_KEY, {}).items()
+            if nodeid in self._collected or not is_path_in_scope(get_nodeid_path(self._config, nodeid), scope)
+        }
+        durations.update(self._durations)
+        cache.set(SHARDING_DURATIONS_CACHE_KEY, durations)
+
+
+def get_locality_key(item) -> str:
+    """
+    Tests of the same class (or module for functions) are kept in one shard,
+    so class and module scoped fixtures are not set up on several nodes.
+    """
+    parent = item.getparent(_pytest.python.Class)
+    if parent is None:
+        parent = item.getparent(_pytest.python.Module)
+    if parent is None:
+        return item.nodeid
+    return parent.nodeid
+
+
+def get_shards(group_durations: Dict[Tuple[str, str], float], shard_count: int) -> Dict[Tuple[str, str], int]:
+    """
+    Groups are keyed by (stage, locality key) and assigned from the longest to the shortest one
+    to the shard with the least time of the same stage, then with the least total time.
+    Sorting is fully determined by durations and keys, so every node computes the same split.
+    """
+    totals = [0.0] * shard_count
+    stage_totals: Dict[str, List[float]] = {}
+    shards = {}
+    for group, duration in sorted(group_durations.items(), key=lambda x: (-x[1], x[0])):
+        stage_loads = stage_totals.setdefault(group[0], [0.0] * shard_count)
+        shard = min(range(shard_count), key=lambda i: (stage_loads[i], totals[i], i))
+        stage_loads[shard] += duration
+        totals[shard] += duration
+        shards[group] = shard
+    return shards
+
+
+def select_shard(config, items, stages: Dict[str, str]) -> None:
+    cache = getattr(config, "cache", None)
+    durations = cache.get(SHARDING_DURATIONS_CACHE_KEY, {}) if cache is not None else {}
+    known_durations = [durations[item.nodeid] for item in items if item.nodeid in durations]
+    default_duration = sum(known_durations) / len(known_durations) if known_durations else SHARDING_DEFAULT_DURATION
+
+    item_groups = {}
+    group_durations: Dict[Tuple[str, str], float] = {}
+    for item in items:
+        group = (stages.get(item.nodeid, ""), get_locality_key(item))
+        item_groups[item.nodeid] = group
+        group_durations[group] = group_durations.get(group, 0.0) + durations.get(item.nodeid, default_duration)
+
+    shards = get_shards(group_durations, config.option.shard_count)
+    selected = []
+    deselected = []
+    for item in items:
+        if shards[item_groups[item.nodeid]] == config.option.shard_index:
+            selected.append(item)
+        else:
+            deselected.append(item)
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+        items[:] = selected
 
 
 def to_upper_case(lst):
@@ -57,7 +57,7 @@ setup(
     py_modules=["pytest_markers_presence"],
     python_requires=">=3.7",
     install_requires=[
-        "pytest>=6.0",
+        "pytest>=7.0",
         "allure-pytest>=2.8.19",
         "pydantic>=2.0",
     ],
@@ -1,7 +1,19 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import allure_commons
 import pytest
+from _pytest import reports
+from allure_commons import model2
 
 from pytest_markers_presence import (
+    ASSERT_STEPS_ASYNC_HELP,
+    ASSERT_STEPS_BUDGET_HEADLINE,
     ASSERT_STEPS_HELP,
     ASSERTION_FAILED_MESSAGE,
     BDD_FORMAT_HELP,
@@ -12,18 +24,61 @@ from pytest_markers_presence import (
     NO_FEATURE_CLASSES_HEADLINE,
     NO_STORY_FUNCTIONS_HEADLINE,
     NO_TITLE_FUNCTIONS_HEADLINE,
+    MARKERS_BASELINE_HEADLINE,
+    MARKERS_BASELINE_USAGE_ERROR,
+    MARKERS_BASELINE_WRITTEN_HEADLINE,
+    MIN_TESTS_SUBFOLDERS_NUM,
+    NO_TAGS_GHERKIN_HEADLINE,
+    NO_TITLE_GHERKIN_HEADLINE,
     NOT_CLASSIFIED_FUNCTIONS_HEADLINE,
+    SHARD_COUNT_HELP,
+    SHARDING_DURATIONS_CACHE_KEY,
+    STAGING_BUDGETS_HEADLINE,
+    STAGING_DURATIONS_HEADLINE,
+    STAGING_DURATIONS_NO_STAGE,
+    STAGING_REORDER_REPORT,
+    STAGING_STAGE_PROPERTY,
     STAGING_HELP,
+    STAGING_REORDER_HELP,
     STAGING_WARNINGS_HELP,
     FEATURE_TITLE_HELP,
+    LINT_LF_CACHE_KEY,
+    LINT_LF_HEADLINE,
+    LINT_LF_NOTHING_HEADLINE,
+    UNDECODABLE_GHERKIN_HEADLINE,
     UNIT_TESTS_MARKER,
+    AllureComparison,
+    AssertStepsContext,
+    AttachmentsWriter,
     ExitCodes,
+    LintOptions,
+    LintRule,
     Options,
+    StagingBudgets,
+    StagingDurations,
+    StreamingHistogram,
+    get_assert_steps_context,
+    get_shards,
+    lint,
 )
 
 _DEFAULT_HELP_CHECKING_LENGTH = 40
 
 
+def make_report(nodeid, keywords, when="call", duration=0.1, user_properties=()):
+    """Report as it is received by 'pytest-xdist' controller, which does not collect items."""
+    return reports.TestReport(
+        nodeid=nodeid,
+        location=(nodeid, 0, nodeid),
+        keywords=dict.fromkeys([nodeid.rsplit("::", 1)[-1], *keywords], 1),
+        outcome="passed",
+        longrepr=None,
+        when=when,
+        duration=duration,
+        user_properties=list(user_properties),
+    )
+
+
 class TestMarkersPresencePositive:
     def test_stage_markers_globally(self, request):
         assert len(
@@ -147,11 +202,14 @@ class TestMarkersPresencePositive:
             [
                 "Markers presence:*",
                 f"*{Options.STAGING}*{STAGING_HELP[:_DEFAULT_HELP_CHECKING_LENGTH]}*",
+                f"*{Options.STAGING_REORDER}*{STAGING_REORDER_HELP[:_DEFAULT_HELP_CHECKING_LENGTH]}*",
                 f"*{Options.ASSERT_STEPS}*{ASSERT_STEPS_HELP[:_DEFAULT_HELP_CHECKING_LENGTH]}*",
+                f"*{Options.ASSERT_STEPS_ASYNC}*{ASSERT_STEPS_ASYNC_HELP[:_DEFAULT_HELP_CHECKING_LENGTH]}*",
                 f"*{Options.BDD_FORMAT}*{BDD_FORMAT_HELP[:_DEFAULT_HELP_CHECKING_LENGTH]}*",
                 f"*{Options.FEATURE_TITLE}*{FEATURE_TITLE_HELP[:_DEFAULT_HELP_CHECKING_LENGTH]}*",
                 f"*{Options.WARNINGS}*{STAGING_WARNINGS_HELP[:_DEFAULT_HELP_CHECKING_LENGTH]}*",
                 f"*{Options.FAIL_ON_ALL_SKIPPED}*{FAIL_ON_ALL_SKIPPED_HELP[:_DEFAULT_HELP_CHECKING_LENGTH]}*",
+                f"*{Options.SHARD_COUNT}*{SHARD_COUNT_HELP[:_DEFAULT_HELP_CHECKING_LENGTH]}*",
             ]
         )
 
@@ -213,6 +271,841 @@ class TestMarkersPresencePositive:
         assert result.ret == ExitCodes.SUCCESS
 
 
+class TestLint:
+    @pytest.fixture
+    def testfile(self, testdir):
+        return testdir.makepyfile(
+            """
+            import allure
+
+            @allure.feature('Feature')
+            class TestFeature:
+                @allure.story('Story')
+                def test_ok(self):
+                    assert True
+
+            class TestClass:
+                def test_case(self):
+                    assert True
+
+            def test_function():
+                assert True
+            """
+        )
+
+    def test_lint_paths(self, testfile):
+        for _ in range(2):
+            result = lint(testfile, LintOptions(bdd_format=True))
+            assert result.failed
+            assert result.collection_errors == 0
+            assert [(v.rule, v.name) for v in result.violations] == [
+                (LintRule.NOT_CLASSIFIED_FUNCTION, "test_function"),
+                (LintRule.NO_FEATURE_CLASS, "TestClass"),
+                (LintRule.NO_STORY_FUNCTION, "test_case"),
+                (LintRule.NO_STORY_FUNCTION, "test_function"),
+            ]
+
+    def test_lint_session(self, testdir, testfile):
+        items, _ = testdir.inline_genitems()
+        result = lint(items[0].session, LintOptions(feature_title=True))
+        assert {(v.rule, v.nodeid.split("::", 1)[1]) for v in result.violations} == {
+            (LintRule.NOT_CLASSIFIED_FUNCTION, "test_function"),
+            (LintRule.NO_FEATURE_CLASS, "TestClass"),
+            (LintRule.NO_TITLE_FUNCTION, "TestFeature::test_ok"),
+            (LintRule.NO_TITLE_FUNCTION, "TestClass::test_case"),
+            (LintRule.NO_TITLE_FUNCTION, "test_function"),
+        }
+
+    def test_lint_success(self, testdir):
+        testfile = testdir.makepyfile(
+            """
+            import allure
+
+            @allure.feature('Feature')
+            class TestFeature:
+                @allure.title('Title')
+                def test_ok(self):
+                    assert True
+            """
+        )
+        assert not lint(testfile, LintOptions(feature_title=True)).failed
+
+    def test_lint_with_addopts(self, testdir, testfile, capsys):
+        testdir.makeini("[pytest]\naddopts = -v -l\n")
+        result = lint(testfile, LintOptions(bdd_format=True))
+        assert result.collection_errors == 0
+        assert len(result.violations) == 4
+        assert capsys.readouterr().out == ""
+
+    def test_lint_keeps_tested_modules(self, testdir):
+        testdir.makepyfile(app="VALUE = 1")
+        testdir.makepyfile(test_app="import app\n\ndef test_app():\n    assert app.VALUE\n")
+        lint(testdir.tmpdir, LintOptions(bdd_format=True))
+        app, test_app = sys.modules["app"], sys.modules["test_app"]
+        lint(testdir.tmpdir, LintOptions(bdd_format=True))
+        assert sys.modules["app"] is app
+        assert sys.modules["test_app"] is not test_app
+
+    def test_lint_baseline(self, testdir, testfile):
+        baseline = testdir.tmpdir.join("baseline.txt")
+        assert len(lint(testfile, LintOptions(bdd_format=True, baseline=str(baseline))).violations) == 4
+        assert not baseline.exists()
+
+        assert not lint(testfile, LintOptions(bdd_format=True, baseline=str(baseline), baseline_update=True)).failed
+        assert len(baseline.readlines()) == 4
+
+        testfile.write("def test_new():\n    assert True\n")
+        result = lint(testfile, LintOptions(bdd_format=True, baseline=str(baseline)))
+        assert [v.name for v in result.violations] == ["test_new", "test_new"]
+        assert len(baseline.readlines()) == 4
+
+    def test_lint_outside_session(self, testdir):
+        testdir.makepyfile(
+            run="""
+            import json
+            import pathlib
+
+            from pytest_markers_presence import LintOptions, lint
+
+            path = pathlib.Path("test_api.py")
+            path.write_text("import allure\\n\\n@allure.feature('F')\\nclass TestA:\\n    @allure.story('S')\\n    def test_a(self):\\n        pass\\n")
+            print(json.dumps([v.location for v in lint(str(path), LintOptions(bdd_format=True)).violations]))
+            path.write_text("def test_function():\\n    pass\\n")
+            result = lint(str(path), LintOptions(bdd_format=True))
+            print(json.dumps(sorted((v.rule.value, v.location) for v in result.violations)))
+            """
+        )
+        result = testdir.runpython(testdir.tmpdir.join("run.py"))
+        assert result.ret == 0, result.stderr.str()
+        assert result.outlines == [
+            "[]",
+            json.dumps(
+                [
+                    [LintRule.NO_STORY_FUNCTION.value, "test_api.py"],
+                    [LintRule.NOT_CLASSIFIED_FUNCTION.value, "test_api.py"],
+                ]
+            ),
+        ]
+
+
+class TestLintLastFailed:
+    def test_lint_lf(self, testdir):
+        bad_class = """
+            class TestClass:
+                def test_case(self):
+                    assert True
+            """
+        titled_class = """
+            import allure
+
+            @allure.feature('Feature')
+            class TestClass:
+                @allure.title('Title')
+                def test_case(self):
+                    assert True
+            """
+        testdir.makepyfile(test_a=bad_class, test_b=titled_class)
+        result = testdir.runpytest(Options.FEATURE_TITLE)
+        assert result.ret == ExitCodes.ERROR
+        last_run = json.loads(testdir.tmpdir.join(".pytest_cache", "v", LINT_LF_CACHE_KEY).read())
+        assert last_run["nodeids"] == ["test_a.py::TestClass", "test_a.py::TestClass::test_case"]
+
+        # the fixed file is re-checked, the untouched one is not collected at all
+        testdir.makepyfile(test_a=titled_class, test_b=bad_class.replace("TestClass", "TestOther").replace("test_case", "test_other"))
+        os.utime(testdir.tmpdir.join("test_b.py"), (0, 0))
+        result = testdir.runpytest(Options.FEATURE_TITLE, Options.LINT_LF)
+        result.stdout.fnmatch_lines([f"*{LINT_LF_HEADLINE.format(count=1)}*", f"*{CLASSES_OK_HEADLINE}*"])
+        assert result.ret == ExitCodes.SUCCESS
+
+        result = testdir.runpytest(Options.FEATURE_TITLE, Options.LINT_LF)
+        result.stdout.fnmatch_lines([f"*{LINT_LF_NOTHING_HEADLINE}*"])
+        assert result.ret == ExitCodes.SUCCESS
+
+        result = testdir.runpytest(Options.FEATURE_TITLE, Options.LINT_LF, Options.LINT_LF_ALL)
+        result.stdout.fnmatch_lines([f"*{NO_FEATURE_CLASSES_HEADLINE}*", "*TestOther*test_b.py*"])
+        assert result.ret == ExitCodes.ERROR
+
+    def test_lint_lf_ignored_paths(self, testdir):
+        testdir.makeini(
+            """
+            [pytest]
+            norecursedirs = build
+            """
+        )
+        testdir.makeconftest("collect_ignore = ['legacy']")
+        bad_class = "class TestBad:\n    def test_bad(self):\n        assert True\n"
+        testdir.makepyfile(test_a=bad_class)
+        result = testdir.runpytest(Options.FEATURE_TITLE)
+        assert result.ret == ExitCodes.ERROR
+
+        os.utime(testdir.tmpdir.join("test_a.py"), (0, 0))
+        testdir.tmpdir.join("generated", "conftest.py").ensure().write("collect_ignore_glob = ['test_gen_*.py']")
+        for path in ("build/test_build.py", "legacy/test_legacy.py", "generated/test_gen_x.py", "test_new.py"):
+            testdir.tmpdir.join(path).ensure().write(bad_class.replace("Bad", path.split("_")[-1][:-3].title()))
+        result = testdir.runpytest(Options.FEATURE_TITLE, Options.LINT_LF)
+        result.stdout.fnmatch_lines([f"*{LINT_LF_HEADLINE.format(count=2)}*"])
+        assert "test_build.py" not in result.stdout.str()
+        assert "test_legacy.py" not in result.stdout.str()
+        assert "test_gen_x.py" not in result.stdout.str()
+
+
+class TestGherkinFeatures:
+    def test_gherkin_features(self, testdir):
+        testdir.makeini(
+            """
+            [pytest]
+            gherkin_feature_tags = allure.label.epic:Epic
+            gherkin_scenario_tags = smoke
+            """
+        )
+        testdir.tmpdir.join("features", "checkout.feature").write(
+            "@allure.label.epic:Epic\n"
+            "Feature: Checkout\n"
+            "  Background:\n"
+            "    Given a cart\n"
+            "\n"
+            "  @smoke\n"
+            "  Scenario: Pay by card\n"
+            '    Given a docstring\n      """\n      Scenario: not a scenario\n      """\n'
+            "\n"
+            "  Scenario:\n"
+            "    Then something\n"
+            "\n"
+            "  @presence_ignore\n"
+            "  Scenario: Ignored\n",
+            ensure=True,
+        )
+        testdir.tmpdir.join("features", "search.feature").write("Feature: Search\n  @smoke\n  Scenario: Find\n")
+        result = testdir.runpytest(Options.BDD_FORMAT, Options.GHERKIN_FEATURES)
+        result.stdout.fnmatch_lines(
+            [
+                f"*{NO_TITLE_GHERKIN_HEADLINE}*",
+                "Scenario: '', location: *features/checkout.feature:13",
+                f"*{NO_TAGS_GHERKIN_HEADLINE}*",
+                "Scenario: '', location: *features/checkout.feature:13, missing tags: @smoke",
+                "Feature: 'Search', location: *features/search.feature:1, missing tags: @allure.label.epic:Epic",
+            ]
+        )
+        assert "not a scenario" not in result.stdout.str()
+        assert "Ignored" not in result.stdout.str()
+        assert result.ret == ExitCodes.ERROR
+
+    def test_gherkin_features_success(self, testdir):
+        testdir.tmpdir.join("test.feature").write("Feature: Search\n  Scenario: Find\n    Given a page\n")
+        result = testdir.runpytest(Options.FEATURE_TITLE, Options.GHERKIN_FEATURES)
+        result.stdout.fnmatch_lines([f"*{CLASSES_OK_HEADLINE}*"])
+        assert result.ret == ExitCodes.SUCCESS
+
+    def test_gherkin_features_undecodable(self, testdir):
+        testdir.tmpdir.join("legacy.feature").write_binary("Feature: Légacy\n  Scenario: Find\n".encode("cp1252"))
+        result = testdir.runpytest(Options.FEATURE_TITLE, Options.GHERKIN_FEATURES)
+        result.stdout.fnmatch_lines([f"*{UNDECODABLE_GHERKIN_HEADLINE}*", "File: 'legacy.feature', location: *:1"])
+        assert result.ret == ExitCodes.ERROR
+
+    def test_gherkin_untitled_scenarios_baseline(self, testdir):
+        feature = testdir.tmpdir.join("test.feature")
+        feature.write("Feature: Search\n  Scenario:\n    Given a page\n  Scenario:\n    Given a page\n")
+        baseline = testdir.tmpdir.join("baseline.txt")
+        result = testdir.runpytest(Options.FEATURE_TITLE, Options.GHERKIN_FEATURES, Options.MARKERS_BASELINE, baseline)
+        result.stdout.fnmatch_lines([f"*{MARKERS_BASELINE_WRITTEN_HEADLINE.format(path=baseline, count=2)}*"])
+
+        feature.write(feature.read() + "  Scenario:\n    Given a page\n")
+        result = testdir.runpytest(Options.FEATURE_TITLE, Options.GHERKIN_FEATURES, Options.MARKERS_BASELINE, baseline)
+        result.stdout.fnmatch_lines([f"*{NO_TITLE_GHERKIN_HEADLINE}*", "Scenario: '', location: *test.feature:6"])
+        assert result.ret == ExitCodes.ERROR
+
+    def test_gherkin_features_usage(self, testdir):
+        result = testdir.runpytest(Options.GHERKIN_FEATURES)
+        assert result.ret == pytest.ExitCode.USAGE_ERROR
+
+
+class TestMarkersBaseline:
+    def test_baseline_ratchet(self, testdir):
+        testdir.makepyfile(
+            test_legacy="""
+            class TestClass:
+                def test_case(self):
+                    assert True
+            """
+        )
+        baseline = testdir.tmpdir.join("baseline.txt")
+        result = testdir.runpytest(Options.BDD_FORMAT, Options.MARKERS_BASELINE, baseline)
+        result.stdout.fnmatch_lines([f"*{MARKERS_BASELINE_WRITTEN_HEADLINE.format(path=baseline, count=2)}*"])
+        assert result.ret == ExitCodes.SUCCESS
+        assert len(baseline.readlines()) == 2
+
+        new_file = testdir.makepyfile(
+            test_new="""
+            def test_function():
+                assert True
+            """
+        )
+        result = testdir.runpytest(Options.BDD_FORMAT, Options.MARKERS_BASELINE, baseline)
+        result.stdout.fnmatch_lines(
+            [
+                f"*{MARKERS_BASELINE_HEADLINE.format(path=baseline, suppressed=2, fixed=0)}*",
+                f"*{NOT_CLASSIFIED_FUNCTIONS_HEADLINE}*",
+                "*test_function*",
+            ]
+        )
+        assert "TestClass" not in result.stdout.str()
+        assert result.ret == ExitCodes.ERROR
+
+        new_file.remove()
+        testdir.makepyfile(
+            test_legacy="""
+            import allure
+
+            @allure.feature('Feature')
+            class TestClass:
+                def test_case(self):
+                    assert True
+            """
+        )
+        result = testdir.runpytest(Options.BDD_FORMAT, Options.MARKERS_BASELINE, baseline)
+        result.stdout.fnmatch_lines([f"*{MARKERS_BASELINE_HEADLINE.format(path=baseline, suppressed=1, fixed=1)}*"])
+        assert result.ret == ExitCodes.SUCCESS
+        assert len(baseline.readlines()) == 1
+
+    def test_baseline_deselected(self, testdir):
+        testdir.makepyfile(
+            test_legacy="""
+            class TestA:
+                def test_a(self):
+                    assert True
+
+            class TestB:
+                def test_b(self):
+                    assert True
+            """
+        )
+        baseline = testdir.tmpdir.join("baseline.txt")
+        result = testdir.runpytest(Options.BDD_FORMAT, Options.MARKERS_BASELINE, baseline)
+        result.stdout.fnmatch_lines([f"*{MARKERS_BASELINE_WRITTEN_HEADLINE.format(path=baseline, count=4)}*"])
+
+        result = testdir.runpytest(Options.BDD_FORMAT, Options.MARKERS_BASELINE, baseline, "-k", "test_a")
+        result.stdout.fnmatch_lines([f"*{MARKERS_BASELINE_HEADLINE.format(path=baseline, suppressed=2, fixed=0)}*"])
+        assert result.ret == ExitCodes.SUCCESS
+        assert len(baseline.readlines()) == 4
+
+    def test_baseline_malformed(self, testdir):
+        testdir.makepyfile(
+            test_legacy="""
+            class TestClass:
+                def test_case(self):
+                    assert True
+            """
+        )
+        baseline = testdir.tmpdir.join("baseline.txt")
+        testdir.runpytest(Options.BDD_FORMAT, Options.MARKERS_BASELINE, baseline)
+        baseline.write("\n" + baseline.read() + "\n")
+        result = testdir.runpytest(Options.BDD_FORMAT, Options.MARKERS_BASELINE, baseline)
+        result.stdout.fnmatch_lines([f"*{MARKERS_BASELINE_HEADLINE.format(path=baseline, suppressed=2, fixed=0)}*"])
+        assert result.ret == ExitCodes.SUCCESS
+
+        baseline.write(baseline.read() + "<<<<<<< HEAD\n")
+        result = testdir.runpytest(Options.BDD_FORMAT, Options.MARKERS_BASELINE, baseline)
+        result.stderr.fnmatch_lines([f"*{MARKERS_BASELINE_USAGE_ERROR.format(path=baseline, line=5)}*"])
+        assert result.ret == pytest.ExitCode.USAGE_ERROR
+
+    def test_baseline_partial_run(self, testdir):
+        unit = testdir.tmpdir.join("tests", "unit").ensure("test_unit.py")
+        unit.write("class TestUnit:\n    def test_unit(self):\n        assert True\n")
+        testdir.tmpdir.join("tests", "e2e").ensure("test_e2e.py").write(
+            "class TestE2E:\n    def test_e2e(self):\n        assert True\n"
+        )
+        baseline = testdir.tmpdir.join("baseline.txt")
+        result = testdir.runpytest_subprocess(Options.BDD_FORMAT, Options.MARKERS_BASELINE, baseline, "tests")
+        result.stdout.fnmatch_lines([f"*{MARKERS_BASELINE_WRITTEN_HEADLINE.format(path=baseline, count=4)}*"])
+
+        result = testdir.runpytest_subprocess(Options.BDD_FORMAT, Options.MARKERS_BASELINE, baseline, "tests/unit")
+        result.stdout.fnmatch_lines([f"*{MARKERS_BASELINE_HEADLINE.format(path=baseline, suppressed=2, fixed=0)}*"])
+        assert result.ret == ExitCodes.SUCCESS
+        assert len(baseline.readlines()) == 4
+
+        unit.write("import allure\n\n@allure.feature('Feature')\n" + unit.read())
+        result = testdir.runpytest_subprocess(Options.BDD_FORMAT, Options.MARKERS_BASELINE, baseline, "tests/unit")
+        result.stdout.fnmatch_lines([f"*{MARKERS_BASELINE_HEADLINE.format(path=baseline, suppressed=1, fixed=1)}*"])
+        assert result.ret == ExitCodes.SUCCESS
+        assert len(baseline.readlines()) == 3
+
+        result = testdir.runpytest_subprocess(Options.BDD_FORMAT, Options.MARKERS_BASELINE, baseline, "tests")
+        result.stdout.fnmatch_lines([f"*{MARKERS_BASELINE_HEADLINE.format(path=baseline, suppressed=3, fixed=0)}*"])
+        assert result.ret == ExitCodes.SUCCESS
+
+
+class TestStagingReorder:
+    def test_stages_grouped(self, testdir):
+        testdir.tmpdir.join("tests", "e2e").ensure("__init__.py")
+        testdir.tmpdir.join("tests", "e2e", "conftest.py").write(
+            "import pytest\n\n"
+            "@pytest.fixture(scope='package')\n"
+            "def browser():\n"
+            "    print('BROWSER SETUP')\n"
+            "    yield\n"
+        )
+        for name in ("test_a", "test_c"):
+            testdir.tmpdir.join("tests", "e2e", f"{name}.py").write(f"def {name}(browser):\n    assert True\n")
+        testdir.tmpdir.join("tests", "unit").ensure("test_b.py").write("def test_b():\n    assert True\n")
+
+        paths = ["tests/e2e/test_a.py", "tests/unit/test_b.py", "tests/e2e/test_c.py"]
+        result = testdir.runpytest_subprocess(Options.STAGING, Options.STAGING_REORDER, "-v", "-s", *paths)
+        result.stdout.fnmatch_lines(
+            [
+                f"*{STAGING_REORDER_REPORT.format(before=2, after=1, saved=1)}*",
+                "*test_a.py::test_a*",
+                "*test_c.py::test_c*",
+                "*test_b.py::test_b*",
+            ]
+        )
+        assert result.stdout.str().count("BROWSER SETUP") == 1
+        assert result.ret == pytest.ExitCode.OK
+
+    def test_modules_kept_together(self, testdir):
+        testdir.makeconftest(
+            """
+            import pytest
+
+            @pytest.fixture(scope="session")
+            def db():
+                yield
+            """
+        )
+        for name in ("m1", "m2"):
+            testdir.makepyfile(
+                **{
+                    f"test_{name}": f"""
+                    import pytest
+
+                    @pytest.fixture(scope="module")
+                    def mod():
+                        print("MODULE SETUP")
+                        yield
+
+                    def test_{name}_a(mod):
+                        assert True
+
+                    def test_{name}_b(mod, db):
+                        assert True
+
+                    def test_{name}_c(mod):
+                        assert True
+                    """
+                }
+            )
+        result = testdir.runpytest_subprocess(Options.STAGING_REORDER, "-v", "-s", "test_m1.py", "test_m2.py")
+        result.stdout.fnmatch_lines(
+            [
+                f"*{STAGING_REORDER_REPORT.format(before=3, after=3, saved=0)}*",
+                "*test_m1_a*",
+                "*test_m1_b*",
+                "*test_m1_c*",
+                "*test_m2_a*",
+                "*test_m2_b*",
+                "*test_m2_c*",
+            ]
+        )
+        assert result.stdout.str().count("MODULE SETUP") == 2
+        assert result.ret == pytest.ExitCode.OK
+
+
+class TestStagingManifest:
+    def test_manifest_reused(self, testdir):
+        for stage in ("unit", "e2e"):
+            testdir.tmpdir.join("tests", stage).ensure(f"test_{stage}.py").write(f"def test_{stage}():\n    assert True\n")
+        manifest = testdir.tmpdir.join("stages.json")
+
+        result = testdir.runpytest_subprocess(Options.STAGING, Options.STAGING_MANIFEST, manifest, "-m", "unit")
+        result.assert_outcomes(passed=1, deselected=1)
+        stages = json.loads(manifest.read())["stages"]
+        assert stages == {"tests/unit/test_unit.py::test_unit": "unit", "tests/e2e/test_e2e.py::test_e2e": "e2e"}
+
+        content = json.loads(manifest.read())
+        content["stages"]["tests/e2e/test_e2e.py::test_e2e"] = "unit"
+        manifest.write(json.dumps(content))
+        result = testdir.runpytest_subprocess(Options.STAGING, Options.STAGING_MANIFEST, manifest, "-m", "unit")
+        result.assert_outcomes(passed=2)
+
+        testdir.tmpdir.join("tests", "integration").ensure(dir=True)
+        result = testdir.runpytest_subprocess(Options.STAGING, Options.STAGING_MANIFEST, manifest, "-m", "unit")
+        result.assert_outcomes(passed=1, deselected=1)
+        assert sorted(json.loads(manifest.read())["staging_markers"]) == ["e2e", "integration", "unit"]
+
+    def test_manifest_pruned(self, testdir):
+        testdir.tmpdir.join("tests", "unit").ensure("test_unit.py").write("def test_unit():\n    assert True\n")
+        e2e = testdir.tmpdir.join("tests", "e2e").ensure("test_e2e.py")
+        e2e.write("def test_e2e():\n    assert True\n\ndef test_old():\n    assert True\n")
+        testdir.makepyfile(test_root="def test_root():\n    assert True\n")
+        manifest = testdir.tmpdir.join("stages.json")
+        testdir.runpytest_subprocess(Options.STAGING, Options.STAGING_MANIFEST, manifest)
+        assert "tests/e2e/test_e2e.py::test_old" in json.loads(manifest.read())["stages"]
+
+        e2e.write("def test_e2e():\n    assert True\n")
+        result = testdir.runpytest_subprocess(Options.STAGING, Options.STAGING_MANIFEST, manifest, Options.WARNINGS)
+        result.assert_outcomes(passed=3)
+        result.stdout.fnmatch_lines(
+            [
+                f"*at least {MIN_TESTS_SUBFOLDERS_NUM} directories*",
+                "*Could not add item for test function 'test_root'*",
+            ]
+        )
+        assert json.loads(manifest.read())["stages"] == {
+            "tests/unit/test_unit.py::test_unit": "unit",
+            "tests/e2e/test_e2e.py::test_e2e": "e2e",
+        }
+
+
+class TestStagingDurations:
+    def test_histogram_percentiles(self):
+        histogram = StreamingHistogram()
+        for value in range(1, 1001):
+            histogram.add(value / 1000)
+        assert histogram.count == 1000
+        assert histogram.total == pytest.approx(500.5)
+        for percent in (50, 95, 99):
+            assert histogram.percentile(percent) == pytest.approx(percent / 100, rel=0.05)
+        assert histogram.percentile(100) == 1.0
+
+    def test_stage_durations(self, testdir):
+        for stage in ("unit", "e2e"):
+            testdir.tmpdir.join("tests", stage).ensure(f"test_{stage}.py").write(
+                "\n".join(f"def test_{stage}_{i}():\n    assert True\n" for i in range(3))
+            )
+        report = testdir.tmpdir.join("durations.json")
+        result = testdir.runpytest_subprocess(
+            Options.STAGING, Options.STAGING_DURATIONS, Options.STAGING_DURATIONS_JSON, report
+        )
+        result.stdout.fnmatch_lines(
+            [
+                f"*{STAGING_DURATIONS_HEADLINE}*",
+                "stage*phase*count*total*p50*p95*p99",
+                "e2e*call*3*s*s*s*s",
+                "unit*teardown*3*s*s*s*s",
+            ]
+        )
+        durations = json.loads(report.read())
+        assert set(durations) == {"unit", "e2e"}
+        assert durations["unit"]["call"]["count"] == 3
+        assert set(durations["unit"]["setup"]) == {"count", "total", "min", "max", "p50", "p95", "p99"}
+
+    def test_stage_from_report_keywords(self, testdir):
+        durations = StagingDurations(testdir.parseconfig())
+        durations.staging_markers = ["unit", "e2e"]
+        for stage in ("unit", "e2e"):
+            durations.pytest_runtest_logreport(make_report(f"tests/{stage}/test_{stage}.py::test_case", [stage]))
+        durations.pytest_runtest_logreport(make_report("test_other.py::test_case", []))
+        assert {stage: phases["call"]["count"] for stage, phases in durations.to_dict().items()} == {
+            "unit": 1,
+            "e2e": 1,
+            STAGING_DURATIONS_NO_STAGE: 1,
+        }
+
+
+    def test_stage_from_report_properties(self, testdir):
+        durations = StagingDurations(testdir.parseconfig())
+        durations.staging_markers = ["unit", "e2e"]
+        report = make_report(
+            "tests/e2e/unit/test_a.py::test_case", ["unit", "e2e"], user_properties=[(STAGING_STAGE_PROPERTY, "e2e")]
+        )
+        assert durations.get_report_stage(report) == "e2e"
+
+    def test_stage_property_reported(self, testdir):
+        testdir.tmpdir.join("tests", "e2e", "unit").ensure("test_a.py").write("def test_a():\n    assert True\n")
+        testdir.tmpdir.join("tests", "unit").ensure("test_b.py").write("def test_b():\n    assert True\n")
+        testdir.makeconftest(
+            """
+            def pytest_runtest_logreport(report):
+                if report.when == "call":
+                    print("PROPERTIES", report.nodeid, report.user_properties)
+            """
+        )
+        result = testdir.runpytest_subprocess(Options.STAGING, Options.STAGING_DURATIONS, "-s")
+        assert f"PROPERTIES tests/e2e/unit/test_a.py::test_a [('{STAGING_STAGE_PROPERTY}', 'e2e')]" in result.stdout.str()
+        assert f"PROPERTIES tests/unit/test_b.py::test_b [('{STAGING_STAGE_PROPERTY}', 'unit')]" in result.stdout.str()
+
+    def test_durations_json_not_written_by_worker(self, testdir):
+        testdir.makeconftest(
+            """
+            import pytest
+
+            @pytest.hookimpl(tryfirst=True)
+            def pytest_configure(config):
+                config.workerinput = {"workerid": "gw0"}
+            """
+        )
+        testdir.makepyfile("def test_a():\n    assert True\n")
+        result = testdir.runpytest_subprocess(Options.STAGING_DURATIONS_JSON, "durations.json")
+        assert result.ret == pytest.ExitCode.OK
+        assert not testdir.tmpdir.join("durations.json").exists()
+
+
+class TestStagingBudgets:
+    @pytest.mark.parametrize(
+        ("mode", "exit_code"),
+        [("fail", pytest.ExitCode.TESTS_FAILED), ("warn", pytest.ExitCode.OK)],
+    )
+    def test_budgets_exceeded(self, testdir, mode, exit_code):
+        testdir.makeini(
+            f"""
+            [pytest]
+            staging_test_budgets =
+                unit = 0.05
+            staging_total_budgets =
+                unit = 0.1
+                e2e = 60
+            staging_budgets_mode = {mode}
+            """
+        )
+        testdir.tmpdir.join("tests", "unit").ensure("test_unit.py").write(
+            "import time\n\n"
+            "def test_fast():\n    assert True\n\n"
+            "def test_slow():\n    time.sleep(0.15)\n"
+        )
+        testdir.tmpdir.join("tests", "e2e").ensure("test_e2e.py").write("def test_e2e():\n    assert True\n")
+        result = testdir.runpytest_subprocess(Options.STAGING)
+        result.stdout.fnmatch_lines(
+            [
+                f"*{STAGING_BUDGETS_HEADLINE}*",
+                "Stage 'unit': total *s, budget 0.10s",
+                "Test 'tests/unit/test_unit.py::test_slow' (stage 'unit'): *s, budget 0.050s",
+            ]
+        )
+        assert "test_fast'" not in result.stdout.str()
+        assert "Stage 'e2e'" not in result.stdout.str()
+        assert result.ret == exit_code
+
+    def test_budgets_not_exceeded(self, testdir):
+        testdir.makeini(
+            """
+            [pytest]
+            staging_total_budgets = unit = 60
+            """
+        )
+        testdir.tmpdir.join("tests", "unit").ensure("test_unit.py").write("def test_fast():\n    assert True\n")
+        result = testdir.runpytest_subprocess(Options.STAGING)
+        assert STAGING_BUDGETS_HEADLINE not in result.stdout.str()
+        assert result.ret == pytest.ExitCode.OK
+
+    @pytest.mark.parametrize(
+        ("mode", "exit_code"),
+        [("fail", pytest.ExitCode.OK), ("strict", pytest.ExitCode.TESTS_FAILED), ("warn", pytest.ExitCode.OK)],
+    )
+    def test_budgets_test_exceeded(self, testdir, mode, exit_code):
+        testdir.makeini(
+            f"""
+            [pytest]
+            staging_test_budgets = unit = 0.05
+            staging_total_budgets = unit = 60
+            staging_budgets_mode = {mode}
+            """
+        )
+        testdir.tmpdir.join("tests", "unit").ensure("test_unit.py").write(
+            "import time\n\ndef test_slow():\n    time.sleep(0.1)\n"
+        )
+        result = testdir.runpytest_subprocess(Options.STAGING)
+        result.stdout.fnmatch_lines(
+            [
+                f"*{STAGING_BUDGETS_HEADLINE}*",
+                "Test 'tests/unit/test_unit.py::test_slow' (stage 'unit'): *s, budget 0.050s",
+            ]
+        )
+        assert "Stage 'unit'" not in result.stdout.str()
+        assert result.ret == exit_code
+
+    @pytest.mark.parametrize(("phases", "exceeded"), [("call", False), ("setup call teardown", True)])
+    def test_budgets_phases(self, testdir, phases, exceeded):
+        testdir.makeini(
+            f"""
+            [pytest]
+            staging_test_budgets = unit = 0.1
+            staging_test_budgets_phases = {phases}
+            staging_budgets_mode = strict
+            """
+        )
+        testdir.tmpdir.join("tests", "unit").ensure("test_unit.py").write(
+            "import time\n\nimport pytest\n\n"
+            "@pytest.fixture(scope='session')\ndef db():\n    time.sleep(0.15)\n\n"
+            "def test_first(db):\n    assert True\n"
+        )
+        result = testdir.runpytest_subprocess(Options.STAGING)
+        assert (STAGING_BUDGETS_HEADLINE in result.stdout.str()) is exceeded
+        assert result.ret == (pytest.ExitCode.TESTS_FAILED if exceeded else pytest.ExitCode.OK)
+
+    def test_budgets_stage_from_report_keywords(self, testdir):
+        testdir.makeini(
+            """
+            [pytest]
+            staging_test_budgets = unit = 0.1
+            """
+        )
+        budgets = StagingBudgets(testdir.parseconfig())
+        budgets.staging_markers = ["unit", "e2e"]
+        for when, duration in (("setup", 0.0), ("call", 0.2), ("teardown", 0.0)):
+            budgets.pytest_runtest_logreport(make_report("tests/unit/test_unit.py::test_slow", ["unit"], when, duration))
+        assert budgets.is_exceeded()
+
+    def test_budgets_phases_usage(self, testdir):
+        testdir.makeini(
+            """
+            [pytest]
+            staging_test_budgets = unit = 0.1
+            staging_test_budgets_phases = call cleanup
+            """
+        )
+        result = testdir.runpytest(Options.STAGING)
+        assert result.ret == pytest.ExitCode.USAGE_ERROR
+
+
+class TestSharding:
+    def test_shards_balanced_by_stages(self):
+        group_durations = {
+            ("unit", "test_a.py"): 1.0,
+            ("unit", "test_b.py"): 1.0,
+            ("e2e", "test_c.py::TestC"): 10.0,
+            ("e2e", "test_d.py::TestD"): 8.0,
+            ("e2e", "test_e.py"): 2.0,
+        }
+        shards = get_shards(group_durations, 2)
+        assert shards[("e2e", "test_c.py::TestC")] != shards[("e2e", "test_d.py::TestD")]
+        assert shards[("e2e", "test_e.py")] == shards[("e2e", "test_d.py::TestD")]
+        assert shards[("unit", "test_a.py")] != shards[("unit", "test_b.py")]
+        assert shards == get_shards(dict(reversed(group_durations.items())), 2)
+
+    def test_shards_cover_all_tests(self, testdir):
+        for stage in ("unit", "integration", "e2e"):
+            testdir.tmpdir.join("tests", stage).ensure(f"test_{stage}.py").write(
+                "\n".join(f"def test_{stage}_{i}():\n    assert True\n" for i in range(5))
+            )
+        assert testdir.runpytest_subprocess(Options.STORE_DURATIONS).ret == pytest.ExitCode.OK
+        shard_tests = []
+        for index in range(3):
+            result = testdir.runpytest_subprocess(
+                Options.STAGING, Options.SHARD_COUNT, "3", Options.SHARD_INDEX, str(index), "-v"
+            )
+            assert result.ret == pytest.ExitCode.OK
+            shard_tests.append({line.split(" ")[0] for line in result.outlines if " PASSED" in line})
+        assert all(shard_tests)
+        assert sum(len(tests) for tests in shard_tests) == len(set.union(*shard_tests)) == 15
+
+    def test_stored_durations_pruned(self, testdir):
+        tests_dir = testdir.tmpdir.join("tests")
+        tests_dir.ensure("test_a.py").write("def test_a():\n    assert True\n")
+        tests_dir.ensure("test_b.py").write("def test_b():\n    assert True\n")
+        testdir.tmpdir.ensure("other", "test_c.py").write("def test_c():\n    assert True\n")
+        assert testdir.runpytest_subprocess(Options.STORE_DURATIONS).ret == pytest.ExitCode.OK
+        tests_dir.join("test_b.py").remove()
+        assert testdir.runpytest_subprocess(Options.STORE_DURATIONS, "tests").ret == pytest.ExitCode.OK
+        durations = json.loads(testdir.tmpdir.join(".pytest_cache", "v", SHARDING_DURATIONS_CACHE_KEY).read())
+        assert sorted(durations) == ["other/test_c.py::test_c", "tests/test_a.py::test_a"]
+
+    def test_durations_not_stored_by_worker(self, testdir):
+        testdir.makeconftest(
+            """
+            import pytest
+
+            @pytest.hookimpl(tryfirst=True)
+            def pytest_configure(config):
+                config.workerinput = {"workerid": "gw0"}
+            """
+        )
+        testdir.makepyfile("def test_a():\n    assert True\n")
+        assert testdir.runpytest_subprocess(Options.STORE_DURATIONS).ret == pytest.ExitCode.OK
+        assert not testdir.tmpdir.join(".pytest_cache", "v", SHARDING_DURATIONS_CACHE_KEY).exists()
+
+    def test_shard_options_usage(self, testdir):
+        result = testdir.runpytest(Options.SHARD_COUNT, "2")
+        assert result.ret == pytest.ExitCode.USAGE_ERROR
+
+
+class TestAssertStepsContext:
+    COMPARISONS = 100
+
+    @staticmethod
+    def compare(index):
+        context = get_assert_steps_context()
+        comparison = AllureComparison(op="==", left={"t": context.nodeid, "i": index}, right={})
+        comparison.compile_allure_step(context=context)
+
+    def test_concurrent_tests_steps(self):
+        contexts = [
+            AssertStepsContext(nodeid=f"test_{i}", test_result=model2.TestResult(name=f"test_{i}")) for i in range(4)
+        ]
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            futures = [
+                executor.submit(context.bind(self.compare), index)
+                for index in range(self.COMPARISONS)
+                for context in contexts
+            ]
+            for future in futures:
+                future.result()
+
+        async def check(index):
+            await asyncio.sleep(0)
+            self.compare(index)
+
+        async def main():
+            await asyncio.gather(
+                *(
+                    context.bind(asyncio.ensure_future)(check(index))
+                    for index in range(self.COMPARISONS)
+                    for context in contexts
+                )
+            )
+
+        asyncio.run(main())
+
+        for context in contexts:
+            steps = context.test_result.steps
+            assert len(steps) == 2 * self.COMPARISONS
+            assert all(f"'t': '{context.nodeid}'" in step.name for step in steps)
+            assert all(step.status == "failed" for step in steps)
+
+
+class TestAttachmentsWriter:
+    class BlockingLogger:
+        def __init__(self):
+            self.released = threading.Event()
+            self.written = {}
+
+        @allure_commons.hookimpl
+        def report_attached_data(self, body, file_name):
+            self.released.wait()
+            self.written[file_name] = body
+
+    @pytest.fixture
+    def logger(self):
+        logger = self.BlockingLogger()
+        allure_commons.plugin_manager.register(logger)
+        yield logger
+        logger.released.set()
+        allure_commons.plugin_manager.unregister(logger)
+
+    def test_backpressure_and_drain(self, logger):
+        writer = AttachmentsWriter(config=None, maxsize=2)
+        sizes = []
+        data = {"state": "original"}
+        submitter = threading.Thread(
+            target=lambda: [writer.submit(data, f"{i}-attachment.json", sizes.append) for i in range(5)]
+        )
+        submitter.start()
+        submitter.join(timeout=0.5)
+        assert submitter.is_alive()
+        assert writer._queue.full()
+        data["state"] = "mutated"
+
+        logger.released.set()
+        submitter.join()
+        writer.pytest_sessionfinish()
+        assert writer._queue.empty()
+        assert sorted(logger.written) == [f"{i}-attachment.json" for i in range(5)]
+        states = [json.loads(body)["state"] for body in logger.written.values()]
+        assert states[:3] == ["original"] * 3
+        assert states[-1] == "mutated"
+        assert sum(sizes) == sum(len(body) for body in logger.written.values())
+        writer.pytest_unconfigure()
+
+
 class TestMarkersPresenceNegative:
     @pytest.mark.parametrize(
         ("option", "message"),
@@ -398,6 +1291,241 @@ class TestMarkersPresenceNegative:
         )
         assert result.ret == pytest.ExitCode.TESTS_FAILED
 
+    def test_assert_steps_async_attachments(self, testdir):
+        testdir.makepyfile(
+            """
+            x = {"a": "very very very long string, i can not see the end!.."}
+            y = {"a": "other very very very long string, i can not see the end again!.."}
+
+            def test_case():
+                assert x == y
+            """
+        )
+        result = testdir.runpytest(Options.ASSERT_STEPS, Options.ASSERT_STEPS_ASYNC, "--alluredir=allure-results")
+        result.stdout.fnmatch_lines(["*AssertionError", "*1 failed in*"])
+        assert result.ret == pytest.ExitCode.TESTS_FAILED
+
+        results_dir = testdir.tmpdir.join("allure-results")
+        test_result = json.loads(next(iter(results_dir.listdir("*-result.json"))).read())
+        (step,) = test_result["steps"]
+        assert [a["name"] for a in step["attachments"]] == ["Left", "Right"]
+        for attachment in step["attachments"]:
+            assert json.loads(results_dir.join(attachment["source"]).read())
+
+    def test_assert_steps_allure_hooks(self, testdir):
+        testdir.makeconftest(
+            """
+            import allure_commons
+
+            class StepsRecorder:
+                def __init__(self):
+                    self.titles = []
+
+                @allure_commons.hookimpl
+                def start_step(self, uuid, title, params):
+                    self.titles.append(title)
+
+            RECORDER = StepsRecorder()
+
+            def pytest_configure(config):
+                allure_commons.plugin_manager.register(RECORDER)
+
+            def pytest_unconfigure(config):
+                allure_commons.plugin_manager.unregister(RECORDER)
+
+            def pytest_terminal_summary(terminalreporter):
+                terminalreporter.write_line(f"started steps: {RECORDER.titles}")
+            """
+        )
+        testdir.makepyfile(
+            """
+            def test_case():
+                assert {"a": 1} == {"a": 2}
+            """
+        )
+        result = testdir.runpytest(Options.ASSERT_STEPS, "--alluredir=allure-results")
+        assert f"started steps: ['{ASSERTION_FAILED_MESSAGE}" in result.stdout.str()
+        assert result.ret == pytest.ExitCode.TESTS_FAILED
+
+    @pytest.mark.parametrize(
+        "plugins",
+        [("allure_pytest.plugin", "pytest_markers_presence"), ("pytest_markers_presence", "allure_pytest.plugin")],
+    )
+    def test_assert_steps_plugins_order(self, testdir, plugins):
+        testdir.makeconftest(f"pytest_plugins = {list(plugins)}")
+        testdir.makepyfile(
+            """
+            from concurrent.futures import ThreadPoolExecutor
+
+            from pytest_markers_presence import bind_assert_steps
+
+            def compare(index):
+                try:
+                    assert {"index": index} == {}
+                except AssertionError:
+                    pass
+
+            def test_case():
+                with ThreadPoolExecutor(max_workers=2) as executor:
+                    list(executor.map(bind_assert_steps(compare), range(4)))
+                compare(4)
+            """
+        )
+        result = testdir.runpytest(
+            "-p", "no:allure_pytest", "-p", "no:markers-presence", Options.ASSERT_STEPS, "--alluredir=allure-results"
+        )
+        assert result.ret == pytest.ExitCode.OK
+
+        results_dir = testdir.tmpdir.join("allure-results")
+        test_result = json.loads(next(iter(results_dir.listdir("*-result.json"))).read())
+        assert len(test_result["steps"]) == 5
+        assert all(step["name"].startswith(ASSERTION_FAILED_MESSAGE) for step in test_result["steps"])
+
+    @pytest.mark.parametrize(
+        "options",
+        [
+            [Options.ASSERT_STEPS_SAMPLE_EVERY, "2"],
+            [Options.ASSERT_STEPS_MAX_PER_TEST, "3", Options.ASSERT_STEPS_SAMPLE_EVERY, "0"],
+            [Options.ASSERT_STEPS_MAX_PER_TEST, "-1"],
+            [Options.ASSERT_STEPS_MAX_BYTES_PER_TEST, "0"],
+            [Options.ASSERT_STEPS_MAX_BYTES_PER_SESSION, "-5"],
+        ],
+    )
+    def test_assert_steps_budget_usage(self, testdir, options):
+        result = testdir.runpytest(Options.ASSERT_STEPS, *options)
+        assert result.ret == pytest.ExitCode.USAGE_ERROR
+
+    @pytest.mark.parametrize("options", [[], [Options.ASSERT_STEPS_ASYNC]])
+    def test_assert_steps_attachments_mutated_after_compare(self, testdir, options):
+        testdir.makepyfile(
+            """
+            def test_case():
+                data = {"state": "original very very very long string"}
+                for i in range(3):
+                    try:
+                        assert data == {}
+                    except AssertionError:
+                        data["state"] = f"mutated very very long string {i}"
+            """
+        )
+        result = testdir.runpytest(Options.ASSERT_STEPS, *options, "--alluredir=allure-results")
+        assert result.ret == pytest.ExitCode.OK
+
+        results_dir = testdir.tmpdir.join("allure-results")
+        test_result = json.loads(next(iter(results_dir.listdir("*-result.json"))).read())
+        states = [
+            json.loads(results_dir.join(step["attachments"][0]["source"]).read())["state"]
+            for step in test_result["steps"]
+        ]
+        assert states == ["original very very very long string"] + [f"mutated very very long string {i}" for i in range(2)]
+
+    @pytest.mark.parametrize(
+        ("options", "expected_steps", "dropped"),
+        [
+            ([Options.ASSERT_STEPS_MAX_PER_TEST, "3"], 3, 8),
+            ([Options.ASSERT_STEPS_MAX_PER_TEST, "3", Options.ASSERT_STEPS_SAMPLE_EVERY, "4"], 5, 6),
+            ([Options.ASSERT_STEPS_MAX_BYTES_PER_TEST, "1"], 1, 10),
+            ([Options.ASSERT_STEPS_MAX_BYTES_PER_SESSION, "1"], 1, 10),
+        ],
+    )
+    def test_assert_steps_budget(self, testdir, options, expected_steps, dropped):
+        testdir.makepyfile(
+            """
+            x = ["very very very long string, i can not see the end!.."]
+
+            def test_case():
+                for i in range(10):
+                    try:
+                        assert x == [i]
+                    except AssertionError:
+                        pass
+                assert x == []
+            """
+        )
+        result = testdir.runpytest(Options.ASSERT_STEPS, *options, "--alluredir=allure-results")
+        result.stdout.fnmatch_lines(
+            [
+                f"*{ASSERT_STEPS_BUDGET_HEADLINE.format(dropped=dropped, tests=1)}*",
+                f"*test_case*dropped steps: {dropped}*",
+                "*1 failed in*",
+            ]
+        )
+        assert result.ret == pytest.ExitCode.TESTS_FAILED
+
+        results_dir = testdir.tmpdir.join("allure-results")
+        test_result = json.loads(next(iter(results_dir.listdir("*-result.json"))).read())
+        assert len(test_result["steps"]) == expected_steps
+
+    @pytest.mark.parametrize("options", [[], [Options.ASSERT_STEPS_ASYNC]])
+    def test_assert_steps_concurrent_comparisons(self, testdir, options):
+        testdir.makepyfile(
+            """
+            import asyncio
+            from concurrent.futures import ThreadPoolExecutor
+
+            import allure
+            import pytest
+
+            from pytest_markers_presence import bind_assert_steps
+
+            COMPARISONS = 50
+
+            def compare(name, index):
+                try:
+                    assert {"test": name, "index": index} == {"test": "another very very long name"}
+                except AssertionError:
+                    pass
+
+            def check_in_thread(name, index):
+                with allure.step(f"Check {index}"):
+                    compare(name, index)
+
+            @pytest.mark.parametrize("worker", range(4))
+            def test_threads(request, worker):
+                with ThreadPoolExecutor(max_workers=8) as executor:
+                    names = [request.node.name] * COMPARISONS
+                    list(executor.map(bind_assert_steps(check_in_thread), names, range(COMPARISONS)))
+
+            @pytest.mark.parametrize("worker", range(4))
+            def test_tasks(request, worker):
+                async def check(index):
+                    with allure.step(f"Check {index}"):
+                        await asyncio.sleep(0)
+                        compare(request.node.name, index)
+                        await asyncio.sleep(0)
+
+                async def main():
+                    await asyncio.gather(*(check(index) for index in range(COMPARISONS)))
+
+                asyncio.run(main())
+            """
+        )
+        result = testdir.runpytest(Options.ASSERT_STEPS, *options, "--alluredir=allure-results")
+        result.stdout.fnmatch_lines(["*8 passed in*"])
+        assert result.ret == pytest.ExitCode.OK
+
+        def iter_assert_steps(item):
+            for step in item.get("steps", []):
+                if step["name"].startswith(ASSERTION_FAILED_MESSAGE):
+                    yield item, step
+                yield from iter_assert_steps(step)
+
+        results_dir = testdir.tmpdir.join("allure-results")
+        test_results = [json.loads(path.read()) for path in results_dir.listdir("*-result.json")]
+        assert len(test_results) == 8
+        for test_result in test_results:
+            steps = list(iter_assert_steps(test_result))
+            assert len(steps) == 50
+            indexes = set()
+            for parent, step in steps:
+                left, right = step["attachments"]
+                body = json.loads(results_dir.join(left["source"]).read())
+                assert body["test"] == test_result["name"]
+                assert parent["name"] == f"Check {body['index']}"
+                assert step["statusDetails"]["message"].startswith("AssertionError")
+                indexes.add(int(body["index"]))
+            assert indexes == set(range(50))
+
     @pytest.mark.parametrize(
         ("str_bool", "exit_code"),
         [("True", pytest.ExitCode.OK), ("False", pytest.ExitCode.TESTS_FAILED)],